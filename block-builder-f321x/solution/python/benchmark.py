@@ -0,0 +1,229 @@
+"""Benchmark builder.py on bundled or synthetic mempools and save every run as JSON.
+
+Examples:
+    python benchmark.py --size 100000 --max-depth 25 --fan-in 3 --fan-out 5 --max-cluster 64
+    python benchmark.py --mempool ../../mempool.csv --compare benchmark-old.json
+"""
+from datetime import datetime, timezone
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import builder
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+FEE_DISTRIBUTIONS = ("lognormal", "exponential", "uniform")
+
+
+def sample_feerate(rng, distribution, feerate):
+    """Draw a feerate in sat/vB, at least 1, whose median or mean is about feerate."""
+    if distribution == "lognormal":
+        return max(1.0, rng.lognormvariate(math.log(feerate), 1.0))
+    if distribution == "exponential":
+        return 1.0 + rng.expovariate(1 / max(feerate - 1.0, 0.1))
+    return rng.uniform(1.0, 2 * feerate - 1.0)
+
+
+def generate_mempool(size, child_ratio=0.4, max_depth=25, fan_in=3, fan_out=5,
+                     fee_distribution="lognormal", feerate=2.5, seed=0, parent_window=100, max_cluster=64):
+    """Yield (txid, fee, weight, parents) rows of a random mempool, parents before children.
+
+    A child_ratio share of the txs spend up to fan_in of the parent_window most recent txs that
+    are less than max_depth deep and have fewer than fan_out children. Parents are only taken
+    while the cluster they join stays at most max_cluster txs, like Bitcoin Core's cluster limit.
+    """
+    rng = random.Random(seed)
+    # recent txs that can still take children: [txid, depth, children, number]
+    open_parents = []
+    # union-find over tx numbers, the size of a cluster is kept at its root
+    roots = []
+    cluster_sizes = []
+
+    def find(number):
+        while roots[number] != number:
+            roots[number] = roots[roots[number]]
+            number = roots[number]
+        return number
+
+    for number in range(size):
+        txid = f"{rng.getrandbits(256):064x}"
+        weight = min(400000, max(400, int(rng.lognormvariate(math.log(1100), 0.6))))
+        fee = max(1, int(sample_feerate(rng, fee_distribution, feerate) * weight / 4))
+        parents = []
+        clusters = set()
+        cluster_size = 1
+        if open_parents and rng.random() < child_ratio:
+            for parent in rng.sample(open_parents, min(len(open_parents), rng.randint(1, fan_in))):
+                root = find(parent[3])
+                if root not in clusters:
+                    if cluster_size + cluster_sizes[root] > max_cluster:
+                        continue
+                    clusters.add(root)
+                    cluster_size += cluster_sizes[root]
+                parents.append(parent)
+        roots.append(number)
+        cluster_sizes.append(cluster_size)
+        for root in clusters:
+            roots[root] = number
+        for parent in parents:
+            parent[2] += 1
+        depth = 1 + max((parent[1] for parent in parents), default=-1)
+        open_parents = [parent for parent in open_parents if parent[2] < fan_out]
+        if depth + 1 < max_depth:
+            open_parents.append([txid, depth, 0, number])
+        del open_parents[:-parent_window]
+        yield txid, fee, weight, [parent[0] for parent in parents]
+
+
+def write_mempool_csv(rows, path):
+    with open(path, "w") as f:
+        for txid, fee, weight, parents in rows:
+            f.write(f"{txid},{fee},{weight},{';'.join(parents)}\n")
+
+
+def peak_rss_kib():
+    """Return the peak resident set size of this process in KiB, if the platform reports it."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux KiB
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def code_version():
+    """Return the git commit of builder.py, with a -dirty suffix for local changes."""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                              capture_output=True, encoding="utf-8", check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_once(path, strategy, workers):
+    """Run the builder stages on the mempool at path, return timings, peak memory and the block."""
+    timings, memory = {}, {}
+    start = time.perf_counter()
+    mempool = builder.parse_mempool_csv(path)
+    timings["parse_mempool_csv"] = time.perf_counter() - start
+    memory["parse_mempool_csv"] = peak_rss_kib()
+    start = time.perf_counter()
+    builder.set_packet_weights(mempool)
+    builder.calculate_packet_values(mempool)
+    timings["calculate_packet_values"] = time.perf_counter() - start
+    memory["calculate_packet_values"] = peak_rss_kib()
+    start = time.perf_counter()
+    if strategy == "cluster":
+        block = builder.build_block_by_clusters(mempool, workers)
+    else:
+        block = builder.build_block(mempool)
+    timings["build_block"] = time.perf_counter() - start
+    memory["build_block"] = peak_rss_kib()
+    builder.run_checks(mempool, block)
+    result = {
+        "transactions": len(block),
+        "fee": sum(mempool.fees[index] for index in block),
+        "weight": builder.get_block_size(mempool, block),
+    }
+    return timings, memory, len(mempool), result
+
+
+def compare(report, baseline, tolerance):
+    """Print the stage timings against a baseline report, return the stages that got slower."""
+    regressions = []
+    if report["mempool"] != baseline["mempool"]:
+        print("warning: the baseline was run on a different mempool")
+    for stage, seconds in report["timings"].items():
+        before = baseline["timings"].get(stage)
+        if not before:
+            continue
+        ratio = seconds / before
+        print(f"{stage}: {before:.4f}s -> {seconds:.4f}s ({ratio:.2f}x)")
+        if ratio > 1 + tolerance:
+            regressions.append(stage)
+    if report["mempool"] == baseline["mempool"] and report["block"]["fee"] < baseline["block"]["fee"]:
+        print(f"block fee: {baseline['block']['fee']} -> {report['block']['fee']}")
+        regressions.append("fee")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the block builder and save the run as JSON")
+    parser.add_argument("--mempool", help="benchmark this mempool CSV instead of a synthetic one")
+    parser.add_argument("--size", type=int, default=100000, help="synthetic mempool transactions")
+    parser.add_argument("--child-ratio", type=float, default=0.4, help="share of txs with parents")
+    parser.add_argument("--max-depth", type=int, default=25, help="longest ancestor chain")
+    parser.add_argument("--fan-in", type=int, default=3, help="most parents per tx")
+    parser.add_argument("--fan-out", type=int, default=5, help="most children per tx")
+    parser.add_argument("--parent-window", type=int, default=100, help="most recent txs a child can spend")
+    parser.add_argument("--max-cluster", type=int, default=64, help="most txs in a cluster of related txs")
+    parser.add_argument("--fee-distribution", choices=FEE_DISTRIBUTIONS, default="lognormal")
+    parser.add_argument("--feerate", type=float, default=2.5, help="typical feerate in sat/vB")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-mempool", help="also keep the synthetic mempool CSV at this path")
+    parser.add_argument("--strategy", choices=("ancestor", "cluster"), default="ancestor")
+    parser.add_argument("--workers", type=int, default=None, help="processes for cluster linearization")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the fastest counts")
+    parser.add_argument("--output", help="JSON report path, default benchmark-<time>.json")
+    parser.add_argument("--compare", help="earlier JSON report to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown against --compare")
+    args = parser.parse_args()
+
+    generator = None
+    path = args.mempool
+    if path is None:
+        generator = {key: getattr(args, key) for key in
+                     ("size", "child_ratio", "max_depth", "fan_in", "fan_out", "fee_distribution", "feerate", "seed",
+                      "parent_window", "max_cluster")}
+        path = args.save_mempool
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix=".csv")
+            os.close(fd)
+        write_mempool_csv(generate_mempool(**generator), path)
+    try:
+        runs = [run_once(path, args.strategy, args.workers) for _ in range(args.repeat)]
+    finally:
+        if generator is not None and args.save_mempool is None:
+            os.remove(path)
+
+    timings, memory, size, block = runs[0]
+    report = {
+        "version": code_version(),
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "mempool": {"path": args.mempool, "generator": generator, "transactions": size},
+        "strategy": args.strategy,
+        "workers": args.workers,
+        "repeat": args.repeat,
+        "timings": {stage: min(run[0][stage] for run in runs) for stage in timings},
+        # ru_maxrss never goes down, so only the first run tells the stages apart
+        "peak_rss_kib": memory,
+        "block": block,
+    }
+    output = args.output or f"benchmark-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    for stage, seconds in report["timings"].items():
+        print(f"{stage}: {seconds:.4f}s, peak RSS {report['peak_rss_kib'][stage]} KiB")
+    print(f"block: {block['transactions']} txs, fee {block['fee']}, weight {block['weight']}")
+    print(f"saved {output}")
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            sys.exit(f"regressions: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,106 +1,799 @@
-def parse_mempool_csv():
-    """Parse the CSV file and return a list of MempoolTransactions."""
-    mempool = {}
-    try:
-        with open('../../mempool.csv') as f:
-            for line in f.readlines():
-                line_elements = line.strip().split(',')
-                tx = {
-                    "fee": int(line_elements[1]),
-                    "weight": int(line_elements[2]),
-                    "parents": line_elements[3].split(';') if line_elements[3] else None
-                }
-                mempool[line_elements[0]] = tx
-    except:
-        with open('mempool.csv') as f:
-            for line in f.readlines():
-                line_elements = line.strip().split(',')
-                tx = {
-                    "fee": int(line_elements[1]),
-                    "weight": int(line_elements[2]),
-                    "parents": line_elements[3].split(';') if line_elements[3] else None
-                }
-                mempool[line_elements[0]] = tx
+from array import array
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import heapq
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+
+MAX_BLOCK_WEIGHT = 4000000
+# once less weight than this is left, the block tail is filled by a bounded search
+TAIL_WEIGHT = 10000
+TAIL_CANDIDATES = 200
+# the step limit keeps the output reproducible, the time budget caps the latency on slow machines
+TAIL_MAX_STEPS = 10000
+TAIL_TIME_BUDGET = 0.05
+# larger clusters are linearized by ancestor feerate instead of a subset search
+CLUSTER_SEARCH_LIMIT = 64
+# search steps per cluster, once they are spent the rest is taken by best ancestor set
+LINEARIZE_MAX_STEPS = 300
+MEMPOOL_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "mempool.csv")
+# snapshot layout, little-endian: header, fees and weights as int64, txids as 32 raw bytes,
+# parent offsets (count + 1) and parents as uint32 tx indices. The header holds the size and
+# mtime in nanoseconds of the CSV file the snapshot was converted from.
+SNAPSHOT_MAGIC = b"MEMPOOL2"
+SNAPSHOT_HEADER = struct.Struct("<8sIIqq")
+NO_ANCESTORS = frozenset()
+
+
+class SnapshotTxids:
+    """The txid table of a mapped snapshot, decoded to hex one txid at a time."""
+
+    __slots__ = ("table",)
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table) // 32
+
+    def __getitem__(self, index):
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.table[32 * index:32 * index + 32].hex()
+
+
+class SnapshotIndices(Mapping):
+    """txid -> index for a mapped snapshot, built on the first lookup."""
+
+    __slots__ = ("txids", "indices")
+
+    def __init__(self, txids):
+        self.txids = txids
+        self.indices = None
+
+    def _build(self):
+        if self.indices is None:
+            hex_txids = self.txids.table.hex()
+            self.indices = {hex_txids[start:start + 64]: index for index, start in enumerate(range(0, len(hex_txids), 64))}
+        return self.indices
+
+    def __getitem__(self, txid):
+        return self._build()[txid]
+
+    def __iter__(self):
+        return iter(self._build())
+
+    def __len__(self):
+        return len(self.txids)
+
+
+class Mempool:
+    """Transactions interned to integer indices, with fees, weights and parents in compact arrays."""
+
+    __slots__ = ("txids", "indices", "fees", "weights", "parent_offsets", "parents", "pending_parents",
+                 "removed", "children", "ancestors", "packet_fees", "packet_weights")
+
+    def __init__(self):
+        self.txids = []
+        self.indices = {}
+        self.fees = array("q")
+        self.weights = array("q")
+        # parents of tx i are parents[parent_offsets[i]:parent_offsets[i + 1]]
+        self.parent_offsets = array("L", [0])
+        self.parents = array("L")
+        # parent txid -> slots in parents waiting for that txid's own row
+        self.pending_parents = {}
+        # removed txs keep their index as a tombstone so indices stay stable
+        self.removed = bytearray()
+        self.children = []
+        self.ancestors = []
+        self.packet_fees = array("q")
+        self.packet_weights = array("q")
+
+    def __len__(self):
+        return len(self.txids)
+
+    def append(self, txid, fee, weight, parents):
+        """Intern txid as the next index and store its row, return the index."""
+        if txid in self.indices:
+            raise ValueError(f"Duplicate transaction {txid}")
+        index = len(self.txids)
+        self.txids.append(txid)
+        self.indices[txid] = index
+        self.fees.append(fee)
+        self.weights.append(weight)
+        self.removed.append(0)
+        for parent in parents:
+            if parent in self.indices:
+                self.parents.append(self.indices[parent])
+            else:
+                self.pending_parents.setdefault(parent, []).append(len(self.parents))
+                self.parents.append(0)
+        self.parent_offsets.append(len(self.parents))
+        for slot in self.pending_parents.pop(txid, ()):
+            self.parents[slot] = index
+        return index
+
+    def parents_of(self, index):
+        return self.parents[self.parent_offsets[index]:self.parent_offsets[index + 1]]
+
+    def live_indices(self):
+        """Return the indices of the txs that were not removed, in index order."""
+        return [index for index in range(len(self)) if not self.removed[index]]
+
+    def copy_columns(self):
+        """Replace read-only snapshot views with arrays, so txs can be appended."""
+        if isinstance(self.fees, memoryview):
+            self.txids = list(self.txids)
+            self.indices = dict(self.indices)
+            self.fees = array("q", self.fees)
+            self.weights = array("q", self.weights)
+            self.parent_offsets = array("L", self.parent_offsets)
+            self.parents = array("L", self.parents)
+
+
+def parse_mempool_csv(path=MEMPOOL_PATH):
+    """Stream the CSV file into a Mempool, one line at a time."""
+    mempool = Mempool()
+    with open(path) as f:
+        for line in f:
+            txid, fee, weight, parents = line.strip().split(',')
+            mempool.append(txid, int(fee), int(weight), parents.split(';') if parents else ())
+    if mempool.pending_parents:
+        raise ValueError(f"Parents missing from mempool: {', '.join(mempool.pending_parents)}")
     return mempool
 
 
-def add_parent_weight(mempool, child):
-    parent_weight = 0
-    if not mempool[child]["parents"]:
-        return mempool[child]["weight"]
-    for parent in mempool[child]["parents"]:
-        parent_weight += add_parent_weight(mempool, parent)
-    return parent_weight
+def snapshot_path(path):
+    return os.path.splitext(path)[0] + ".snapshot"
 
 
-def add_parent_fee(mempool, child):
-    parent_fee = 0
-    if not mempool[child]["parents"]:
-        return mempool[child]["fee"]
-    for parent in mempool[child]["parents"]:
-        parent_fee += add_parent_fee(mempool, parent)
-    return parent_fee
+def write_snapshot(mempool, path, source):
+    """Write a CSV-loaded mempool as a binary snapshot, source is the os.stat of the CSV file it came from."""
+    count = len(mempool)
+    # written beside the snapshot and renamed over it, so an interrupted run leaves no partial snapshot
+    with open(path + ".tmp", "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, count, len(mempool.parents), source.st_size, source.st_mtime_ns))
+        for column in (mempool.fees, mempool.weights):
+            f.write(array("q", column).tobytes())
+        f.write(bytes.fromhex("".join(mempool.txids)))
+        for column in (mempool.parent_offsets, mempool.parents):
+            f.write(array("I", column).tobytes())
+    os.replace(path + ".tmp", path)
+
+
+def load_snapshot(path, source=None):
+    """Map a binary snapshot into a Mempool whose columns and txids are views of the file, without copies.
+
+    If source is the path of a CSV file, the snapshot must have been converted from it as it is now.
+    """
+    if sys.byteorder != "little":
+        raise ValueError("Mempool snapshots can only be mapped on little-endian machines")
+    with open(path, "rb") as f:
+        data = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    if len(data) < SNAPSHOT_HEADER.size:
+        raise ValueError(f"{path} is not a mempool snapshot")
+    magic, count, parent_count, source_size, source_mtime = SNAPSHOT_HEADER.unpack_from(data)
+    if magic != SNAPSHOT_MAGIC:
+        raise ValueError(f"{path} is not a mempool snapshot")
+    sizes = (("q", 8 * count), ("q", 8 * count), ("B", 32 * count), ("I", 4 * (count + 1)), ("I", 4 * parent_count))
+    if len(data) != SNAPSHOT_HEADER.size + sum(size for _, size in sizes):
+        raise ValueError(f"{path} is truncated or has trailing data")
+    if source is not None:
+        stat = os.stat(source)
+        if (stat.st_size, stat.st_mtime_ns) != (source_size, source_mtime):
+            raise ValueError(f"{path} was not converted from {source} as it is now")
+    offset = SNAPSHOT_HEADER.size
+    columns = []
+    for typecode, size in sizes:
+        columns.append(data[offset:offset + size].cast(typecode))
+        offset += size
+    mempool = Mempool()
+    mempool.fees, mempool.weights, txids, mempool.parent_offsets, mempool.parents = columns
+    mempool.txids = SnapshotTxids(txids)
+    mempool.indices = SnapshotIndices(mempool.txids)
+    mempool.removed = bytearray(count)
+    return mempool
+
+
+def load_mempool(path=MEMPOOL_PATH):
+    """Load the snapshot next to the CSV file if it was converted from the file as it is now, else parse the CSV."""
+    try:
+        return load_snapshot(snapshot_path(path), path)
+    except (OSError, ValueError):
+        pass
+    return parse_mempool_csv(path)
+
+
+def topological_order(mempool):
+    """Return the indices ordered so that every parent comes before its children."""
+    # children lists only link txs that are still in the mempool
+    missing_parents = array("L", [0]) * len(mempool)
+    for children in mempool.children:
+        for child in children:
+            missing_parents[child] += 1
+    order = [index for index in range(len(mempool)) if missing_parents[index] == 0 and not mempool.removed[index]]
+    for index in order:
+        for child in mempool.children[index]:
+            missing_parents[child] -= 1
+            if missing_parents[child] == 0:
+                order.append(child)
+    if len(order) != len(mempool) - mempool.removed.count(1):
+        raise ValueError("Mempool contains a dependency cycle")
+    return order
 
 
 def calculate_packet_values(mempool):
-    for tx in mempool:
-        if mempool[tx]["parents"] is not None:
-           mempool[tx]["packet_weight"] += add_parent_weight(mempool, tx)
-           mempool[tx]["packet_fee"] += add_parent_fee(mempool, tx)
-           mempool[tx]["packet_feerate"] = mempool[tx]["packet_fee"] / mempool[tx]["packet_weight"]
+    """Cache every tx's deduplicated ancestor set and its aggregate fee and weight in one pass."""
+    for index in range(len(mempool)):
+        for parent in mempool.parents_of(index):
+            if not mempool.children[parent]:
+                mempool.children[parent] = []
+            mempool.children[parent].append(index)
+    for index in topological_order(mempool):
+        if mempool.parent_offsets[index] != mempool.parent_offsets[index + 1]:
+            update_packet(mempool, index)
+
+
+def update_packet(mempool, index):
+    """Rebuild a tx's ancestor set and packet values from its parents' cached ancestor sets."""
+    ancestors = set()
+    for parent in mempool.parents_of(index):
+        if not mempool.removed[parent]:
+            ancestors.add(parent)
+            ancestors |= mempool.ancestors[parent]
+    mempool.ancestors[index] = ancestors or NO_ANCESTORS
+    mempool.packet_fees[index] = mempool.fees[index] + sum(mempool.fees[ancestor] for ancestor in ancestors)
+    mempool.packet_weights[index] = mempool.weights[index] + sum(mempool.weights[ancestor] for ancestor in ancestors)
 
 
 def set_packet_weights(mempool):
-    for tx in mempool.values():
-        tx["packet_weight"] = tx["weight"]
-        tx["packet_fee"] = tx["fee"]
-        tx["packet_feerate"] = tx["fee"] / tx["weight"]
+    mempool.packet_fees = array("q", mempool.fees)
+    mempool.packet_weights = array("q", mempool.weights)
+    mempool.ancestors = [NO_ANCESTORS] * len(mempool)
+    mempool.children = [()] * len(mempool)
+
+
+def packet_feerate(mempool, index, modified=None):
+    if modified and index in modified:
+        _, fee, weight = modified[index]
+        return fee / weight
+    return mempool.packet_fees[index] / mempool.packet_weights[index]
 
-def get_block_size(block):
+
+def remaining_ancestors(mempool, index, modified=None):
+    if modified and index in modified:
+        return modified[index][0]
+    return mempool.ancestors[index]
+
+
+def find_descendants(mempool, indices, skip):
+    """Return the descendants of indices, not walking into txs flagged in skip."""
+    descendants = []
+    visited = set()
+    stack = [child for index in indices for child in mempool.children[index]]
+    while stack:
+        descendant = stack.pop()
+        if descendant in visited or skip[descendant]:
+            continue
+        visited.add(descendant)
+        stack.extend(mempool.children[descendant])
+        descendants.append(descendant)
+    return descendants
+
+
+def remove_from_ancestor_sets(mempool, modified, included, package):
+    """Drop an included package from its descendants' packets in modified, return the updated indices."""
+    members = set(package)
+    descendants = find_descendants(mempool, package, included)
+    for descendant in descendants:
+        if descendant not in modified:
+            modified[descendant] = [set(mempool.ancestors[descendant]),
+                                    mempool.packet_fees[descendant], mempool.packet_weights[descendant]]
+        packet = modified[descendant]
+        for ancestor in packet[0] & members:
+            packet[0].discard(ancestor)
+            packet[1] -= mempool.fees[ancestor]
+            packet[2] -= mempool.weights[ancestor]
+    return descendants
+
+
+def get_block_size(mempool, block):
     block_weight = 0
-    for tx_content in block.values():
-        block_weight += tx_content["weight"]
+    for index in block:
+        block_weight += mempool.weights[index]
     return block_weight
 
 
-def add_parents_to_block(block, mempool, child):
-    if child not in mempool:
-        return
-    if not mempool[child]["parents"]:
-        block[child] = mempool[child]
-        del mempool[child]
-        return
-    for parent in mempool[child]["parents"]:
-        add_parents_to_block(block, mempool, parent)
-    block[child] = mempool[child]
-    del mempool[child]
-    return
-
-def build_block(mempool):
-    block = {}
-    while get_block_size(block) < 4000000 and mempool:
-        add_parents_to_block(block, mempool, list(mempool.keys())[0])
-        mempool = dict(sorted(mempool.items(), key=lambda item: item[1]["packet_feerate"], reverse=True))
-    while (get_block_size(block) > 4000000):
-        block.popitem()
+def remaining_package(mempool, index, modified=None):
+    """Return index and its remaining ancestors, parents before children."""
+    # a parent always has fewer remaining ancestors than its child
+    return sorted(remaining_ancestors(mempool, index, modified) | {index},
+                  key=lambda member: (len(remaining_ancestors(mempool, member, modified)), mempool.txids[member]))
+
+
+def is_stale(mempool, modified, included, negative_feerate, index):
+    """Tell if a queue entry was left behind by an included or removed tx or a re-scored package."""
+    return included[index] or mempool.removed[index] or -negative_feerate != packet_feerate(mempool, index, modified)
+
+
+def collect_tail_candidates(mempool, modified, included, queue, space):
+    """Pop the best packages by feerate that still fit into space, return their members."""
+    candidates = []
+    seen = set()
+    while queue and len(candidates) < TAIL_CANDIDATES:
+        negative_feerate, index = heapq.heappop(queue)
+        if index in seen or is_stale(mempool, modified, included, negative_feerate, index):
+            continue
+        seen.add(index)
+        package = remaining_package(mempool, index, modified)
+        if sum(mempool.weights[member] for member in package) <= space:
+            candidates.append(package)
+    return candidates
+
+
+def fill_block_tail(mempool, candidates, space, time_budget=TAIL_TIME_BUDGET, max_steps=TAIL_MAX_STEPS):
+    """Choose the candidate packages paying the most fee within space, by a bounded branch and bound.
+
+    Candidates are tried in feerate order, so the first solution is the greedy fill. The search then
+    backtracks until it is exhausted or runs out of steps or time, and returns the best txs found.
+    """
+    # no tx in the candidates from position i on pays a higher feerate than bounds[i]
+    bounds = [0.0] * (len(candidates) + 1)
+    for position in range(len(candidates) - 1, -1, -1):
+        best_feerate = max(mempool.fees[member] / mempool.weights[member] for member in candidates[position])
+        bounds[position] = max(bounds[position + 1], best_feerate)
+    deadline = time.perf_counter() + time_budget
+    chosen = []
+    in_tail = set()
+    tail_weight = tail_fee = 0
+    best_fee, best = 0, []
+    position = steps = 0
+    while True:
+        while position < len(candidates) and tail_fee + (space - tail_weight) * bounds[position] > best_fee:
+            members = [member for member in candidates[position] if member not in in_tail]
+            members_weight = sum(mempool.weights[member] for member in members)
+            if members and tail_weight + members_weight <= space:
+                chosen.append((position, members))
+                in_tail.update(members)
+                tail_weight += members_weight
+                tail_fee += sum(mempool.fees[member] for member in members)
+            position += 1
+            steps += 1
+        if tail_fee > best_fee:
+            best_fee = tail_fee
+            best = [member for _, members in chosen for member in members]
+        if not chosen or steps >= max_steps or time.perf_counter() > deadline:
+            return best
+        # backtrack: leave out the last chosen package and try the ones after it
+        position, members = chosen.pop()
+        in_tail.difference_update(members)
+        tail_weight -= sum(mempool.weights[member] for member in members)
+        tail_fee -= sum(mempool.fees[member] for member in members)
+        position += 1
+
+
+def score_queue(mempool):
+    """Return a heap of every tx by packet feerate, the index breaks ties in mempool order."""
+    queue = [(-packet_feerate(mempool, index), index) for index in range(len(mempool)) if not mempool.removed[index]]
+    heapq.heapify(queue)
+    return queue
+
+
+def include_package(mempool, queue, modified, included, block, package):
+    """Append a package to the block and re-queue its descendants with their reduced packets."""
+    for member in package:
+        included[member] = 1
+    block.extend(package)
+    for descendant in remove_from_ancestor_sets(mempool, modified, included, package):
+        heapq.heappush(queue, (-packet_feerate(mempool, descendant, modified), descendant))
+
+
+def complete_block(mempool, queue, modified, included, block, block_weight, max_weight, tail_time_budget):
+    """Add packages to a partial block until the tail, fill the tail and return the block.
+
+    queue, modified, included and block are the selection state and are changed in place.
+    """
+    while queue and max_weight - block_weight > TAIL_WEIGHT:
+        negative_feerate, index = heapq.heappop(queue)
+        if is_stale(mempool, modified, included, negative_feerate, index):
+            continue
+        package = remaining_package(mempool, index, modified)
+        package_weight = sum(mempool.weights[member] for member in package)
+        if block_weight + package_weight > max_weight:
+            continue
+        include_package(mempool, queue, modified, included, block, package)
+        block_weight += package_weight
+    space = max_weight - block_weight
+    candidates = collect_tail_candidates(mempool, modified, included, queue, space)
+    block.extend(fill_block_tail(mempool, candidates, space, tail_time_budget))
     return block
 
-def write_block_to_file(block, filename):
+
+def build_block(mempool, queue=None, tail_time_budget=TAIL_TIME_BUDGET, max_weight=MAX_BLOCK_WEIGHT):
+    """Select packages by ancestor feerate from a priority queue, like Bitcoin Core's BlockAssembler.
+
+    Packages that do not fit are skipped, and the last TAIL_WEIGHT of max_weight is filled by
+    fill_block_tail. The cached packets in mempool are left untouched, queue may be a copy of
+    a maintained score heap.
+    """
+    if queue is None:
+        queue = score_queue(mempool)
+    # packets of txs that lost ancestors to the block, like Bitcoin Core's mapModifiedTx
+    modified = {}
+    return complete_block(mempool, queue, modified, bytearray(len(mempool)), [], 0, max_weight, tail_time_budget)
+
+
+def build_blocks(mempool, max_weights, tail_time_budget=TAIL_TIME_BUDGET):
+    """Build one template per weight limit in a single selection pass, return them by limit.
+
+    Every limit takes the same packages until the first one that does not fit the smallest
+    remaining limit, so the selection is shared up to there and then copied for that limit only.
+    Each template equals build_block with that max_weight.
+    """
+    queue = score_queue(mempool)
+    modified = {}
+    included = bytearray(len(mempool))
+    block = []
+    block_weight = 0
+    blocks = {}
+    for max_weight in sorted(set(max_weights)):
+        while queue and max_weight - block_weight > TAIL_WEIGHT:
+            negative_feerate, index = queue[0]
+            if is_stale(mempool, modified, included, negative_feerate, index):
+                heapq.heappop(queue)
+                continue
+            package = remaining_package(mempool, index, modified)
+            package_weight = sum(mempool.weights[member] for member in package)
+            if block_weight + package_weight > max_weight:
+                break
+            heapq.heappop(queue)
+            include_package(mempool, queue, modified, included, block, package)
+            block_weight += package_weight
+        branch_modified = {index: [set(packet[0]), packet[1], packet[2]] for index, packet in modified.items()}
+        blocks[max_weight] = complete_block(mempool, list(queue), branch_modified, bytearray(included), list(block),
+                                            block_weight, max_weight, tail_time_budget)
+    return blocks
+
+
+def fee_curve(mempool, block):
+    """Return the cumulative (weight, fee) after each tx of the block."""
+    curve = []
+    weight = fee = 0
+    for index in block:
+        weight += mempool.weights[index]
+        fee += mempool.fees[index]
+        curve.append((weight, fee))
+    return curve
+
+
+def find_clusters(mempool):
+    """Partition the mempool into connected parent/child clusters, each in topological order."""
+    roots = list(range(len(mempool)))
+
+    def find(index):
+        while roots[index] != index:
+            roots[index] = roots[roots[index]]
+            index = roots[index]
+        return index
+
+    for index in mempool.live_indices():
+        for parent in mempool.parents_of(index):
+            if not mempool.removed[parent]:
+                roots[find(index)] = find(parent)
+    clusters = {}
+    for index in topological_order(mempool):
+        clusters.setdefault(find(index), []).append(index)
+    return list(clusters.values())
+
+
+def best_closed_subset(fees, weights, parent_masks, ancestor_masks, remaining, max_steps):
+    """Return the ancestor-closed subset of remaining with the highest feerate, as a bitmask,
+    and the search steps taken.
+
+    The search starts from the best ancestor set and is exhaustive unless it runs out of steps.
+    """
+    positions = [position for position in range(len(fees)) if remaining >> position & 1]
+    best = best_fee = 0
+    best_weight = 1
+    for position in positions:
+        subset = ancestor_masks[position] & remaining | 1 << position
+        fee = weight = 0
+        while subset:
+            member = (subset & -subset).bit_length() - 1
+            fee += fees[member]
+            weight += weights[member]
+            subset &= subset - 1
+        subset = ancestor_masks[position] & remaining | 1 << position
+        if fee * best_weight > best_fee * weight:
+            best, best_fee, best_weight = subset, fee, weight
+    by_feerate = sorted(range(len(positions)), key=lambda i: -fees[positions[i]] / weights[positions[i]])
+    stack = [(0, 0, 0, 0)]
+    steps = 0
+    while stack and steps < max_steps:
+        i, subset, fee, weight = stack.pop()
+        steps += 1
+        if subset and fee * best_weight > best_fee * weight:
+            best, best_fee, best_weight = subset, fee, weight
+        if i == len(positions):
+            continue
+        # bound: add the undecided txs whose ancestors are not excluded, best feerate first,
+        # for as long as they raise the feerate
+        excluded = remaining & ((1 << positions[i]) - 1) & ~subset
+        bound_fee, bound_weight = fee, weight
+        for j in by_feerate:
+            position = positions[j]
+            if j < i or ancestor_masks[position] & excluded:
+                continue
+            if bound_weight and fees[position] * bound_weight <= bound_fee * weights[position]:
+                break
+            bound_fee += fees[position]
+            bound_weight += weights[position]
+        if bound_fee * best_weight <= best_fee * bound_weight:
+            continue
+        position = positions[i]
+        stack.append((i + 1, subset, fee, weight))
+        if parent_masks[position] & remaining & ~subset == 0:
+            stack.append((i + 1, subset | 1 << position, fee + fees[position], weight + weights[position]))
+    return best, steps
+
+
+def linearize_by_ancestor_feerate(fees, weights, parents):
+    """Order a cluster that is too large to search like build_block would, without a weight limit."""
+    cluster = Mempool()
+    for position in range(len(fees)):
+        cluster.append(str(position), fees[position], weights[position], [str(parent) for parent in parents[position]])
+    set_packet_weights(cluster)
+    calculate_packet_values(cluster)
+    return build_block(cluster, max_weight=math.inf)
+
+
+def linearize_cluster(fees, weights, parents, max_steps=LINEARIZE_MAX_STEPS):
+    """Order a cluster by repeatedly taking its highest-feerate ancestor-closed subset.
+
+    The txs come in topological order and parents holds the positions of each tx's parents.
+    The searches of the whole cluster share max_steps. Return the positions in block order.
+    """
+    if len(fees) > CLUSTER_SEARCH_LIMIT:
+        return linearize_by_ancestor_feerate(fees, weights, parents)
+    parent_masks = []
+    ancestor_masks = []
+    for position in range(len(fees)):
+        parent_mask = ancestor_mask = 0
+        for parent in parents[position]:
+            parent_mask |= 1 << parent
+            ancestor_mask |= 1 << parent | ancestor_masks[parent]
+        parent_masks.append(parent_mask)
+        ancestor_masks.append(ancestor_mask)
+    remaining = (1 << len(fees)) - 1
+    order = []
+    while remaining:
+        if max_steps <= 0:
+            # out of steps the search only finds best ancestor sets, which the heap finds faster
+            rest = [position for position in range(len(fees)) if remaining >> position & 1]
+            local = {position: local_position for local_position, position in enumerate(rest)}
+            order.extend(rest[local_position] for local_position in linearize_by_ancestor_feerate(
+                [fees[position] for position in rest], [weights[position] for position in rest],
+                [[local[parent] for parent in parents[position] if parent in local] for position in rest]))
+            break
+        subset, steps = best_closed_subset(fees, weights, parent_masks, ancestor_masks, remaining, max_steps)
+        max_steps -= steps
+        order.extend(position for position in range(len(fees)) if subset >> position & 1)
+        remaining &= ~subset
+    return order
+
+
+def is_chain(mempool, cluster):
+    """Tell if no tx in the cluster has more than one parent or child, so its order is fixed."""
+    return all(len(mempool.parents_of(index)) < 2 and len(mempool.children[index]) < 2 for index in cluster)
+
+
+def linearize_clusters(mempool, clusters, workers=None):
+    """Linearize every cluster, spreading the ones that need a search over worker processes."""
+    linearizations = list(clusters)
+    jobs = [position for position, cluster in enumerate(clusters) if len(cluster) > 2 and not is_chain(mempool, cluster)]
+    fees, weights, parents = [], [], []
+    for position in jobs:
+        local = {index: local_position for local_position, index in enumerate(clusters[position])}
+        fees.append([mempool.fees[index] for index in clusters[position]])
+        weights.append([mempool.weights[index] for index in clusters[position]])
+        parents.append([[local[parent] for parent in mempool.parents_of(index) if parent in local]
+                        for index in clusters[position]])
+    if workers and workers > 1:
+        with ProcessPoolExecutor(workers) as executor:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            orders = list(executor.map(linearize_cluster, fees, weights, parents, chunksize=chunksize))
+    else:
+        orders = list(map(linearize_cluster, fees, weights, parents))
+    for position, order in zip(jobs, orders):
+        linearizations[position] = [clusters[position][local_position] for local_position in order]
+    return linearizations
+
+
+def chunk_linearization(mempool, order):
+    """Split a linearization into chunks of non-increasing feerate, return (fee, weight, members) lists."""
+    chunks = []
+    for index in order:
+        chunk = [mempool.fees[index], mempool.weights[index], [index]]
+        # merge into the previous chunk while this one pays a higher feerate
+        while chunks and chunk[0] * chunks[-1][1] > chunks[-1][0] * chunk[1]:
+            previous = chunks.pop()
+            chunk = [previous[0] + chunk[0], previous[1] + chunk[1], previous[2] + chunk[2]]
+        chunks.append(chunk)
+    return chunks
+
+
+def build_block_by_clusters(mempool, workers=None, tail_time_budget=TAIL_TIME_BUDGET):
+    """Select cluster chunks by chunk feerate, an alternative to ancestor-feerate selection.
+
+    Each cluster is linearized on its own, optionally across workers processes, and the chunks of
+    all clusters are merged by feerate. A chunk that does not fit is skipped with the chunks that
+    spend from it, and the last TAIL_WEIGHT of the block is filled by fill_block_tail.
+    """
+    cluster_chunks = [chunk_linearization(mempool, order)
+                      for order in linearize_clusters(mempool, find_clusters(mempool), workers)]
+    # chunks of one cluster never increase in feerate, so position keeps their order on ties
+    chunks = sorted((-fee / weight, cluster, position)
+                    for cluster, cluster_chunk in enumerate(cluster_chunks)
+                    for position, (fee, weight, _) in enumerate(cluster_chunk))
+    in_block = set()
+    skipped = set()
+    block = []
+    block_weight = 0
+    for next_chunk, (_, cluster, position) in enumerate(chunks):
+        if MAX_BLOCK_WEIGHT - block_weight <= TAIL_WEIGHT:
+            break
+        _, chunk_weight, members = cluster_chunks[cluster][position]
+        # the earlier chunks of the cluster were all decided, so a chunk can go in unless it
+        # spends from a skipped one, and later chunks independent of it are still tried
+        if (block_weight + chunk_weight > MAX_BLOCK_WEIGHT
+                or any(not skipped.isdisjoint(mempool.ancestors[member]) for member in members)):
+            skipped.update(members)
+            continue
+        block.extend(members)
+        in_block.update(members)
+        block_weight += chunk_weight
+    else:
+        next_chunk = len(chunks)
+    # a tail candidate brings along its ancestors that are not in the block yet
+    space = MAX_BLOCK_WEIGHT - block_weight
+    candidates = []
+    for _, cluster, position in chunks[next_chunk:]:
+        if len(candidates) == TAIL_CANDIDATES:
+            break
+        members = cluster_chunks[cluster][position][2]
+        candidate = set(members).union(*(mempool.ancestors[member] for member in members)) - in_block
+        if sum(mempool.weights[index] for index in candidate) <= space:
+            # a parent always has fewer ancestors than its child
+            candidates.append(sorted(candidate, key=lambda index: len(mempool.ancestors[index])))
+    block.extend(fill_block_tail(mempool, candidates, space, tail_time_budget))
+    return block
+
+
+class BlockBuilder:
+    """Keep a block template current while transactions enter and leave the mempool.
+
+    Every event only re-scores the packets of the affected tx and its descendants and pushes
+    them onto a long-lived score heap, so a new template is a partial walk of a copy of that heap.
+    """
+
+    def __init__(self, mempool=None, tail_time_budget=TAIL_TIME_BUDGET):
+        self.mempool = mempool if mempool is not None else Mempool()
+        self.mempool.copy_columns()
+        self.tail_time_budget = tail_time_budget
+        set_packet_weights(self.mempool)
+        calculate_packet_values(self.mempool)
+        self.queue = []
+        self.rebuild_queue()
+        self.block = None
+
+    def rebuild_queue(self):
+        """Drop stale heap entries left behind by earlier events."""
+        mempool = self.mempool
+        self.queue = [(-packet_feerate(mempool, index), index) for index in mempool.live_indices()]
+        heapq.heapify(self.queue)
+
+    def add_tx(self, txid, fee, weight, parents):
+        """Add a tx whose parents are already in the mempool, return its index."""
+        mempool = self.mempool
+        for parent in parents:
+            if parent not in mempool.indices:
+                raise ValueError(f"Parent {parent} of {txid} is not in the mempool")
+        index = mempool.append(txid, fee, weight, parents)
+        for parent in mempool.parents_of(index):
+            if not mempool.children[parent]:
+                mempool.children[parent] = []
+            mempool.children[parent].append(index)
+        mempool.ancestors.append(NO_ANCESTORS)
+        mempool.children.append(())
+        mempool.packet_fees.append(fee)
+        mempool.packet_weights.append(weight)
+        update_packet(mempool, index)
+        heapq.heappush(self.queue, (-packet_feerate(mempool, index), index))
+        self.block = None
+        return index
+
+    def remove_tx(self, txid):
+        """Remove a confirmed or evicted tx, its descendants stay and are re-scored without it.
+
+        An eviction removes the descendants with their own events, as Bitcoin Core reports them.
+        """
+        mempool = self.mempool
+        if txid not in mempool.indices:
+            raise ValueError(f"{txid} is not in the mempool")
+        index = mempool.indices.pop(txid)
+        mempool.removed[index] = 1
+        for parent in mempool.parents_of(index):
+            if not mempool.removed[parent]:
+                mempool.children[parent].remove(index)
+        descendants = find_descendants(mempool, [index], mempool.removed)
+        # the stale ancestor counts still order parents before children
+        for descendant in sorted(descendants, key=lambda descendant: len(mempool.ancestors[descendant])):
+            update_packet(mempool, descendant)
+            heapq.heappush(self.queue, (-packet_feerate(mempool, descendant), descendant))
+        mempool.txids[index] = None
+        mempool.children[index] = ()
+        mempool.ancestors[index] = NO_ANCESTORS
+        if len(self.queue) > 2 * len(mempool.indices) + 1024:
+            self.rebuild_queue()
+        self.block = None
+
+    def template(self):
+        """Return the block for the current mempool as a list of indices."""
+        if self.block is None:
+            self.block = build_block(self.mempool, list(self.queue), self.tail_time_budget)
+        return self.block
+
+def write_block_to_file(mempool, block, filename):
     with open(filename, 'w') as f:
-        for txid, tx in block.items():
-            f.write(f"{txid}\n")
+        for index in block:
+            f.write(f"{mempool.txids[index]}\n")
 
-def run_checks(block):
-    if get_block_size(block) > 4000000:
+def run_checks(mempool, block):
+    if get_block_size(mempool, block) > MAX_BLOCK_WEIGHT:
         raise Exception("Block too big!")
 
 def main():
-    mempool = parse_mempool_csv()
+    parser = argparse.ArgumentParser(description="Build a block from mempool.csv into block.txt")
+    parser.add_argument("--strategy", choices=("ancestor", "cluster"), default="ancestor",
+                        help="select by ancestor package feerate or by linearized cluster chunks")
+    parser.add_argument("--workers", type=int, default=None, help="processes for cluster linearization")
+    parser.add_argument("--write-snapshot", action="store_true",
+                        help="convert mempool.csv into a binary snapshot that later runs load instead")
+    parser.add_argument("--weights", type=int, nargs="+", metavar="WEIGHT",
+                        help="build one template per weight limit into block-WEIGHT.txt, with its cumulative "
+                             "weight,fee curve in curve-WEIGHT.csv")
+    args = parser.parse_args()
+    if args.weights and args.strategy != "ancestor":
+        parser.error("--weights needs the ancestor strategy")
+    if args.weights and max(args.weights) > MAX_BLOCK_WEIGHT:
+        parser.error(f"weight limits can be at most {MAX_BLOCK_WEIGHT}")
+    if args.write_snapshot:
+        # stat first, so a CSV changed while it is parsed leaves the snapshot out of date
+        source = os.stat(MEMPOOL_PATH)
+        write_snapshot(parse_mempool_csv(), snapshot_path(MEMPOOL_PATH), source)
+        return
+    mempool = load_mempool()
     set_packet_weights(mempool)
     calculate_packet_values(mempool)
-    mempool = dict(sorted(mempool.items(), key=lambda item: item[1]["packet_feerate"], reverse=True))
-    block = build_block(mempool)
-    run_checks(block)
-    write_block_to_file(block, 'block.txt')
+    if args.weights:
+        for max_weight, block in build_blocks(mempool, args.weights).items():
+            write_block_to_file(mempool, block, f'block-{max_weight}.txt')
+            with open(f'curve-{max_weight}.csv', 'w') as f:
+                for weight, fee in fee_curve(mempool, block):
+                    f.write(f"{weight},{fee}\n")
+        return
+    if args.strategy == "cluster":
+        block = build_block_by_clusters(mempool, args.workers)
+    else:
+        block = build_block(mempool)
+    run_checks(mempool, block)
+    write_block_to_file(mempool, block, 'block.txt')
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Validate block.txt files against mempool.csv, many templates at once across worker processes.
+
+Examples:
+    python validator.py block.txt
+    python validator.py --workers 8 candidates/*.txt
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import mmap
+import multiprocessing
+import sys
+
+import builder
+
+# set in the parent before the workers fork, so they inherit it instead of unpickling a copy
+_shared = None
+
+
+def share_mempool(mempool):
+    """Copy the columns the validator reads into one anonymous shared mmap.
+
+    Returns the txid -> index dict and the fees, weights, parent offsets and parents as memoryviews
+    over the mmap, which forked workers read without copying. A snapshot's columns already are.
+    """
+    if isinstance(mempool.fees, memoryview):
+        # the txid lookup is built here once, before the workers fork
+        return dict(mempool.indices), mempool.fees, mempool.weights, mempool.parent_offsets, mempool.parents
+    columns = (mempool.fees, mempool.weights, mempool.parent_offsets, mempool.parents)
+    sizes = [len(column) * column.itemsize for column in columns]
+    shared = mmap.mmap(-1, max(1, sum(sizes)))
+    views = []
+    offset = 0
+    for column, size in zip(columns, sizes):
+        view = memoryview(shared)[offset:offset + size]
+        view[:] = column.tobytes()
+        views.append(view.cast(column.typecode))
+        offset += size
+    return (mempool.indices, *views)
+
+
+def validate_block(shared, txids):
+    """Check a block in one pass and return (error, fee, weight), error is None for a valid block."""
+    indices, fees, weights, parent_offsets, parents = shared
+    included = bytearray(len(fees))
+    fee = weight = 0
+    for position, txid in enumerate(txids):
+        index = indices.get(txid)
+        if index is None:
+            return f"line {position + 1}: {txid} is not in the mempool", fee, weight
+        if included[index]:
+            return f"line {position + 1}: {txid} appears twice", fee, weight
+        for parent in parents[parent_offsets[index]:parent_offsets[index + 1]]:
+            if not included[parent]:
+                return f"line {position + 1}: {txid} comes before its parent", fee, weight
+        included[index] = 1
+        fee += fees[index]
+        weight += weights[index]
+    if weight > builder.MAX_BLOCK_WEIGHT:
+        return f"weight {weight} is over {builder.MAX_BLOCK_WEIGHT}", fee, weight
+    return None, fee, weight
+
+
+def read_block(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def validate_file(path):
+    """Validate one block file against the shared mempool, return (path, transactions, error, fee, weight)."""
+    txids = read_block(path)
+    return (path, len(txids), *validate_block(_shared, txids))
+
+
+def validate_files(mempool, paths, workers=None):
+    """Validate block files against mempool in order, in forked worker processes if workers is not 1."""
+    global _shared
+    _shared = share_mempool(mempool)
+    if workers == 1 or len(paths) < 2 or "fork" not in multiprocessing.get_all_start_methods():
+        return [validate_file(path) for path in paths]
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        return list(executor.map(validate_file, paths, chunksize=max(1, len(paths) // (8 * (workers or 4)))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check block files for duplicates, parent order and weight")
+    parser.add_argument("blocks", nargs="+", help="block files with one txid per line")
+    parser.add_argument("--mempool", default=builder.MEMPOOL_PATH, help="mempool CSV the blocks were built from, its snapshot is used if current")
+    parser.add_argument("--workers", type=int, default=None, help="validator processes, 1 to validate in this one")
+    args = parser.parse_args()
+    mempool = builder.load_mempool(args.mempool)
+    invalid = 0
+    for path, transactions, error, fee, weight in validate_files(mempool, args.blocks, args.workers):
+        if error is None:
+            print(f"{path}: valid, {transactions} txs, fee {fee}, weight {weight}")
+        else:
+            invalid += 1
+            print(f"{path}: invalid, {error}")
+    if invalid:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
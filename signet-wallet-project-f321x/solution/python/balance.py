@@ -1,10 +1,21 @@
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from decimal import Decimal
-from ecdsa import SigningKey, SECP256k1
-from subprocess import run
-from typing import List, Tuple
+from ecdsa import SECP256k1, VerifyingKey
+from functools import lru_cache
+from typing import Dict, List, Tuple
+import argparse
+import base64
+import ecc
 import hashlib
 import hmac
+import http.client
 import json
+import os
+import pickle
+import queue
+import sys
 
 # Provided by administrator
 WALLET_NAME = "wallet_107"
@@ -59,17 +70,26 @@ def deserialize_key(b: bytes) -> object:
 
 # Derive the secp256k1 compressed public key from a given private key
 # BONUS POINTS: Implement ECDSA yourself and multiply you key by the generator point!
+# ecc.backend multiplies with precomputed generator tables, or libsecp256k1 if installed.
 def get_pub_from_priv(priv: bytes) -> bytes:
-    secret_obj = SigningKey.from_string(priv, curve=SECP256k1)
-    pub_bytes = secret_obj.get_verifying_key().to_string("compressed")
-    # pub_bytes = secret_obj.get_verifying_key().to_string()
-    return pub_bytes
+    return ecc.backend.pubkey(priv)
+
+
+# Serialize a curve point as a compressed public key: 0x02 or 0x03 by the parity of y, then x
+def compress_point(point) -> bytes:
+    return bytes([2 + (point.y() & 1)]) + point.x().to_bytes(32, 'big')
+
+
+# Parse a compressed public key back into a curve point
+def decompress_pubkey(pub: bytes):
+    return VerifyingKey.from_string(pub, curve=SECP256k1).pubkey.point
 
 
 # Perform a BIP32 parent private key -> child private key operation
 # Return a JSON object with "key" and "chaincode" properties as bytes
 # https://github.com/bitcoin/bips/blob/master/bip-0032.mediawiki#user-content-Private_parent_key_rarr_private_child_key
-def derive_priv_child(key: bytes, chaincode: bytes, index: int, hardened: bool) -> object:
+# The parent public key can be passed in as pub if the caller already knows it.
+def derive_priv_child(key: bytes, chaincode: bytes, index: int, hardened: bool, pub: bytes = None) -> object:
     # If so (hardened child): let I = HMAC-SHA512(Key = cpar, Data = 0x00 || ser256(kpar) || ser32(i)).
     # (Note: The 0x00 pads the private key to make it 33 bytes long.)
     if hardened:
@@ -77,7 +97,7 @@ def derive_priv_child(key: bytes, chaincode: bytes, index: int, hardened: bool)
         I = hmac.new(chaincode, b'\x00' + key + int(index).to_bytes(4, 'big'), hashlib.sha512).digest()
     # If not (normal child): let I = HMAC-SHA512(Key = cpar, Data = serP(point(kpar)) || ser32(i)).
     else:
-        I = hmac.new(chaincode, get_pub_from_priv(key) + int(index).to_bytes(4, 'big'), hashlib.sha512).digest()
+        I = hmac.new(chaincode, (pub or get_pub_from_priv(key)) + int(index).to_bytes(4, 'big'), hashlib.sha512).digest()
     IL, IR = I[:32], I[32:]
     key_int = int.from_bytes(key, 'big')
     IL_int = int.from_bytes(IL, 'big')
@@ -90,23 +110,72 @@ def derive_priv_child(key: bytes, chaincode: bytes, index: int, hardened: bool)
     return result_dict
 
 
+# Perform a BIP32 parent public key -> child public key operation, for watch-only wallets
+# Return a JSON object with "pub" and "chaincode" properties as bytes
+# https://github.com/bitcoin/bips/blob/master/bip-0032.mediawiki#public-parent-key--public-child-key
+def derive_pub_child(pub: bytes, chaincode: bytes, index: int) -> object:
+    if index >= 0x80000000:
+        raise ValueError("Hardened children cannot be derived from a public key")
+    # let I = HMAC-SHA512(Key = cpar, Data = serP(Kpar) || ser32(i)), the child key is point(IL) + Kpar
+    I = hmac.new(chaincode, pub + int(index).to_bytes(4, 'big'), hashlib.sha512).digest()
+    IL, IR = I[:32], I[32:]
+    point = SECP256k1.generator * int.from_bytes(IL, 'big') + decompress_pubkey(pub)
+    return {
+        "pub": compress_point(point),
+        "chaincode": IR
+    }
+
+
+# Derive the BIP32 node at path below an extended key, as a JSON object with "key"
+# (None below a public key), "pub" and "chaincode" properties.
+# Every level is cached, so the parent of a wallet's address keys and its public key
+# are derived once instead of once per address.
+@lru_cache(maxsize=None)
+def derive_node(key: bytes, chaincode: bytes, path: Tuple[Tuple[int, bool], ...]) -> object:
+    if not path:
+        if len(key) == 33:
+            return {"key": None, "pub": key, "chaincode": chaincode}
+        return {"key": key, "pub": get_pub_from_priv(key), "chaincode": chaincode}
+    parent = derive_node(key, chaincode, path[:-1])
+    index, hardened = path[-1]
+    if parent["key"] is None:
+        if hardened:
+            raise ValueError("Hardened children cannot be derived from a public key")
+        child = derive_pub_child(parent["pub"], parent["chaincode"], index)
+        child["key"] = None
+        return child
+    child = derive_priv_child(parent["key"], parent["chaincode"], index, hardened, parent["pub"])
+    child["pub"] = get_pub_from_priv(child["key"])
+    return child
+
+
+# Given an extended private or public key and a BIP32 derivation path whose last entry is
+# the first address index, derive count consecutive address keys in one batch.
+# Return (private keys or None for a public key, compressed public keys, witness programs).
+def derive_wallet_keys(key: bytes, chaincode: bytes, path: List[Tuple[int, bool]], count: int = 2001):
+    parent = derive_node(key, chaincode, tuple((int(index), hardened) for index, hardened in path[:-1]))
+    first, hardened = int(path[-1][0]), path[-1][1]
+    privs = [] if parent["key"] is not None else None
+    pubs = []
+    for index in range(first, first + count):
+        if privs is None:
+            if hardened:
+                raise ValueError("Hardened children cannot be derived from a public key")
+            pub = derive_pub_child(parent["pub"], parent["chaincode"], index)["pub"]
+        else:
+            child = derive_priv_child(parent["key"], parent["chaincode"], index, hardened, parent["pub"])
+            privs.append(child["key"])
+            pub = get_pub_from_priv(child["key"])
+        pubs.append(pub)
+    return privs, pubs, [get_p2wpkh_program(pub) for pub in pubs]
+
+
 # Given an extended private key and a BIP32 derivation path,
 # compute the first 2000 child private keys.
 # Return an array of keys encoded as bytes.
 # The derivation path is formatted as an array of (index: int, hardened: bool) tuples.
 def get_wallet_privs(key: bytes, chaincode: bytes, path: List[Tuple[int, bool]]) -> List[bytes]:
-    privs = []
-    for index, hardened in path[:-1]:
-        child = derive_priv_child(key, chaincode, int(index), hardened)
-        key = child["key"]
-        chaincode = child["chaincode"]
-    index = int(path[-1][0])
-    hardened = path[-1][1]
-    while len(privs) < 2001:
-        child = derive_priv_child(key, chaincode, index, hardened)
-        privs.append(child["key"])
-        index += 1
-    return privs
+    return derive_wallet_keys(key, chaincode, path)[0]
 
 
 # Derive the p2wpkh witness program (aka scriptPubKey) for a given compressed public key.
@@ -121,20 +190,373 @@ def get_p2wpkh_program(pubkey: bytes, version: int=0) -> bytes:
     return version.to_bytes(1, 'big') + len(pubkey_hash).to_bytes(1, 'big') + pubkey_hash
 
 
+SIGNET_RPC_PORT = 38332
+# bitcoin.conf options that apply to mainnet only unless set in a network section
+# https://github.com/bitcoin/bitcoin/blob/master/doc/bitcoin-conf.md#network-specific-options
+NETWORK_ONLY_OPTIONS = {"rpcport", "rpcconnect"}
+# same as bitcoin-cli's -rpcclienttimeout default
+RPC_TIMEOUT = 900
+RPC_POOL_SIZE = 4
+# blocks fetched per JSON-RPC batch request
+RPC_BATCH_SIZE = 16
+# batches in flight while the scan applies earlier blocks, at most one connection each
+RPC_PREFETCH = RPC_POOL_SIZE
+# blocks whose utxo changes are kept in the checkpoint so a reorg can be undone
+MAX_REORG_DEPTH = 100
+# unused keys kept derived after the last used one of each branch, as in BIP44
+GAP_LIMIT = 20
+# Golomb-Rice parameters of BIP158 basic block filters
+BASIC_FILTER_P = 19
+BASIC_FILTER_M = 784931
+# kept next to this script, whatever directory it is run from
+CHECKPOINT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "checkpoint.pkl")
+
+
+class RpcError(Exception):
+    def __init__(self, message: str, code: int = None):
+        super().__init__(message)
+        self.code = code
+
+
+# Default Bitcoin Core datadir of this platform
+# https://github.com/bitcoin/bitcoin/blob/master/doc/files.md#data-directory-location
+def default_datadir() -> str:
+    if sys.platform == "win32":
+        return os.path.join(os.environ["APPDATA"], "Bitcoin")
+    if sys.platform == "darwin":
+        return os.path.expanduser("~/Library/Application Support/Bitcoin")
+    return os.path.expanduser("~/.bitcoin")
+
+
+# Read the options of bitcoin.conf that apply to signet: the top-level ones,
+# overridden by the ones in the [signet] section. The NETWORK_ONLY_OPTIONS only count
+# in [signet], at top level they are meant for mainnet.
+def read_bitcoin_conf(path: str) -> Dict[str, str]:
+    options = {}
+    signet_options = {}
+    section = None
+    with open(path) as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if line.startswith("[") and line.endswith("]"):
+                section = line[1:-1]
+            elif "=" in line and section in (None, "signet"):
+                key, value = (part.strip() for part in line.split("=", 1))
+                if section is None and key in NETWORK_ONLY_OPTIONS:
+                    continue
+                (options if section is None else signet_options)[key] = value
+    options.update(signet_options)
+    return options
+
+
+# Find the RPC endpoint and credentials the way bitcoin-cli -signet does:
+# rpcuser/rpcpassword from bitcoin.conf if set, else the cookie file of the signet datadir.
+# Returns (host, port, "user:password").
+def find_rpc_auth(datadir: str = None, conf: str = None) -> Tuple[str, int, str]:
+    datadir = datadir or default_datadir()
+    conf = conf or os.path.join(datadir, "bitcoin.conf")
+    options = read_bitcoin_conf(conf) if os.path.exists(conf) else {}
+    datadir = options.get("datadir", datadir)
+    host = options.get("rpcconnect", "127.0.0.1")
+    port = int(options.get("rpcport", SIGNET_RPC_PORT))
+    if ":" in host and not host.startswith("["):
+        host, port = host.rsplit(":", 1)[0], int(host.rsplit(":", 1)[1])
+    if "rpcpassword" in options:
+        return host, port, f"{options.get('rpcuser', '')}:{options['rpcpassword']}"
+    cookie = options.get("rpccookiefile", ".cookie")
+    if not os.path.isabs(cookie):
+        cookie = os.path.join(datadir, "signet", cookie)
+    try:
+        with open(cookie) as f:
+            return host, port, f.read().strip()
+    except OSError:
+        raise RpcError(f"No rpcpassword in {conf} and no cookie file at {cookie}")
+
+
+# JSON-RPC over HTTP with keep-alive connections from a small pool,
+# so threads can share one client and every call skips the TCP handshake.
+class RpcClient:
+    def __init__(self, host: str, port: int, auth: str, pool_size: int = RPC_POOL_SIZE, timeout: float = RPC_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.headers = {
+            "Authorization": "Basic " + base64.b64encode(auth.encode()).decode(),
+            "Content-Type": "application/json",
+        }
+        self.idle = queue.LifoQueue(pool_size)
+
+    @classmethod
+    def from_datadir(cls, datadir: str = None, conf: str = None, **kwargs) -> "RpcClient":
+        return cls(*find_rpc_auth(datadir, conf), **kwargs)
+
+    # POST a request body and return the decoded JSON response,
+    # retrying once on a fresh connection if a kept-alive one was closed by the node.
+    def post(self, body: bytes):
+        for attempt in range(2):
+            try:
+                connection = self.idle.get_nowait()
+            except queue.Empty:
+                connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                connection.request("POST", "/", body, self.headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if attempt:
+                    raise
+                continue
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                try:
+                    self.idle.put_nowait(connection)
+                except queue.Full:
+                    connection.close()
+            if response.status == 401:
+                raise RpcError("RPC authorization failed, check rpcuser/rpcpassword or the cookie file")
+            try:
+                return json.loads(data, parse_float=Decimal)
+            except ValueError:
+                raise RpcError(f"RPC request failed with HTTP {response.status} {response.reason}")
+
+    def call(self, method: str, *params):
+        reply = self.post(json.dumps({"jsonrpc": "1.0", "id": 0, "method": method, "params": list(params)}).encode())
+        if reply.get("error"):
+            raise RpcError(reply["error"]["message"], reply["error"]["code"])
+        return reply["result"]
+
+    # Send many calls in one JSON-RPC batch request, return their results in order.
+    # calls is a list of (method, params) tuples.
+    def batch(self, calls: List[Tuple[str, list]]) -> list:
+        if not calls:
+            return []
+        replies = self.post(json.dumps([{"jsonrpc": "1.0", "id": i, "method": method, "params": list(params)}
+                                        for i, (method, params) in enumerate(calls)]).encode())
+        if isinstance(replies, dict):
+            raise RpcError(replies["error"]["message"], replies["error"]["code"])
+        results = [None] * len(calls)
+        for reply in replies:
+            if reply.get("error"):
+                raise RpcError(reply["error"]["message"], reply["error"]["code"])
+            results[reply["id"]] = reply["result"]
+        return results
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
+
+rpc_client = None
+
+
+def get_rpc_client() -> RpcClient:
+    global rpc_client
+    if rpc_client is None:
+        rpc_client = RpcClient.from_datadir()
+    return rpc_client
+
+
+# Run fetch_batch on the heights in batches of batch_size, with up to prefetch batches
+# in flight on worker threads, and yield the items of the returned lists in height order.
+def prefetch_batches(fetch_batch, heights, batch_size: int = RPC_BATCH_SIZE, prefetch: int = RPC_PREFETCH):
+    prefetch = max(1, prefetch)
+    heights = list(heights)
+    batches = [heights[start:start + batch_size] for start in range(0, len(heights), batch_size)]
+    with ThreadPoolExecutor(prefetch) as executor:
+        pending = deque()
+        for batch_heights in batches:
+            if len(pending) == prefetch:
+                yield from pending.popleft().result()
+            pending.append(executor.submit(fetch_batch, batch_heights))
+        while pending:
+            yield from pending.popleft().result()
+
+
+# Fetch the verbosity 2 blocks at heights with prefetch_batches and yield them in height order.
+# With raw the serialized blocks are fetched instead and yielded as raw_block objects.
+def fetch_blocks(rpc: RpcClient, heights, raw: bool = False, batch_size: int = RPC_BATCH_SIZE,
+                 prefetch: int = RPC_PREFETCH):
+    def fetch_batch(batch_heights):
+        block_hashes = rpc.batch([("getblockhash", [h]) for h in batch_heights])
+        if raw:
+            return [raw_block(block) for block in rpc.batch([("getblock", [block_hash, 0]) for block_hash in block_hashes])]
+        return rpc.batch([("getblock", [block_hash, 2]) for block_hash in block_hashes])
+
+    return prefetch_batches(fetch_batch, heights, batch_size, prefetch)
+
+
+# SipHash-2-4 of data with the 64-bit keys k0 and k1, as BIP158 hashes filter elements
+# https://www.aumasson.jp/siphash/siphash.pdf
+def siphash24(k0: int, k1: int, data: bytes) -> int:
+    mask = 0xffffffffffffffff
+    v0 = k0 ^ 0x736f6d6570736575
+    v1 = k1 ^ 0x646f72616e646f6d
+    v2 = k0 ^ 0x6c7967656e657261
+    v3 = k1 ^ 0x7465646279746573
+    # the last word holds the remaining bytes and the message length in its top byte
+    tail = len(data) - len(data) % 8
+    words = [int.from_bytes(data[i:i + 8], 'little') for i in range(0, tail, 8)]
+    words.append(int.from_bytes(data[tail:], 'little') | (len(data) & 0xff) << 56)
+    # two SipRounds per message word, then four after the finalization constant
+    rounds = [(word, 2) for word in words] + [(None, 4)]
+    for word, count in rounds:
+        if word is None:
+            v2 ^= 0xff
+        else:
+            v3 ^= word
+        for _ in range(count):
+            v0 = (v0 + v1) & mask
+            v1 = ((v1 << 13) | (v1 >> 51)) & mask ^ v0
+            v0 = ((v0 << 32) | (v0 >> 32)) & mask
+            v2 = (v2 + v3) & mask
+            v3 = ((v3 << 16) | (v3 >> 48)) & mask ^ v2
+            v0 = (v0 + v3) & mask
+            v3 = ((v3 << 21) | (v3 >> 43)) & mask ^ v0
+            v2 = (v2 + v1) & mask
+            v1 = ((v1 << 17) | (v1 >> 47)) & mask ^ v2
+            v2 = ((v2 << 32) | (v2 >> 32)) & mask
+        if word is not None:
+            v0 ^= word
+    return v0 ^ v1 ^ v2 ^ v3
+
+
+# Read a CompactSize integer at offset, return it and the offset after it
+def read_compact_size(data: bytes, offset: int) -> Tuple[int, int]:
+    first = data[offset]
+    if first < 0xfd:
+        return first, offset + 1
+    size = {0xfd: 2, 0xfe: 4, 0xff: 8}[first]
+    return int.from_bytes(data[offset + 1:offset + 1 + size], 'little'), offset + 1 + size
+
+
+# Test a BIP158 basic block filter (as returned by getblockfilter) against scripts,
+# return True if any of them may be in the block. The Golomb-Rice coded set is decoded
+# in order and merged with the sorted hashes of the scripts, so decoding stops early
+# once the set passes the largest script hash.
+# https://github.com/bitcoin/bips/blob/master/bip-0158.mediawiki#golomb-coded-sets
+def gcs_match(block_filter: bytes, block_hash: str, scripts: List[bytes]) -> bool:
+    n, offset = read_compact_size(block_filter, 0)
+    if n == 0 or not scripts:
+        return False
+    # the SipHash key is the first 16 bytes of the block hash in internal byte order
+    key = bytes.fromhex(block_hash)[::-1]
+    k0 = int.from_bytes(key[0:8], 'little')
+    k1 = int.from_bytes(key[8:16], 'little')
+    f = n * BASIC_FILTER_M
+    targets = sorted((siphash24(k0, k1, script) * f) >> 64 for script in scripts)
+    # the set is read most significant bit first, a byte at a time into a small accumulator
+    # whose low count bits are still unread, so each element costs its own bits only
+    accumulator = 0
+    count = 0
+    value = 0
+    target = 0
+    for _ in range(n):
+        # the quotient is unary coded: a run of 1 bits ended by a 0
+        quotient = 0
+        while True:
+            if count == 0:
+                if offset == len(block_filter):
+                    raise ValueError("Truncated block filter")
+                accumulator = block_filter[offset]
+                offset += 1
+                count = 8
+            count -= 1
+            if not accumulator >> count & 1:
+                break
+            quotient += 1
+        while count < BASIC_FILTER_P:
+            if offset == len(block_filter):
+                raise ValueError("Truncated block filter")
+            accumulator = (accumulator << 8) | block_filter[offset]
+            offset += 1
+            count += 8
+        count -= BASIC_FILTER_P
+        value += (quotient << BASIC_FILTER_P) | (accumulator >> count) & ((1 << BASIC_FILTER_P) - 1)
+        accumulator &= (1 << count) - 1
+        while targets[target] < value:
+            target += 1
+            if target == len(targets):
+                return False
+        if targets[target] == value:
+            return True
+    return False
+
+
+# Yield the blocks at heights in order, but download only the ones whose BIP158 filter matches
+# one of the programs in program_owners. The filters and headers are prefetched; a block that
+# does not match is yielded without transactions. program_owners is read at every block,
+# so programs derived while scanning are tested from the next block on.
+# The node needs -blockfilterindex=1.
+def fetch_matching_blocks(rpc: RpcClient, heights, program_owners: Dict[bytes, dict], raw: bool = False,
+                          batch_size: int = RPC_BATCH_SIZE, prefetch: int = RPC_PREFETCH):
+    def fetch_batch(batch_heights):
+        block_hashes = rpc.batch([("getblockhash", [h]) for h in batch_heights])
+        replies = rpc.batch([call for block_hash in block_hashes
+                             for call in (("getblockheader", [block_hash]), ("getblockfilter", [block_hash, "basic"]))])
+        return list(zip(replies[0::2], replies[1::2]))
+
+    for header, block_filter in prefetch_batches(fetch_batch, heights, batch_size, prefetch):
+        if gcs_match(bytes.fromhex(block_filter["filter"]), header["hash"], list(program_owners)):
+            if raw:
+                yield raw_block(rpc.call("getblock", header["hash"], 0))
+            else:
+                yield rpc.call("getblock", header["hash"], 2)
+        else:
+            yield {"hash": header["hash"], "height": header["height"],
+                   "previousblockhash": header.get("previousblockhash"), "tx": []}
+
+
+# Positions of the arguments that bitcoin-cli passes as JSON instead of strings, for the
+# methods used here; every other argument stays a string, like a label "123" would.
+# https://github.com/bitcoin/bitcoin/blob/master/src/rpc/client.cpp (vRPCConvertParams)
+BCLI_JSON_ARGS = {
+    "getblockhash": {0},
+    "getblock": {1},
+    "getblockheader": {1},
+    "decoderawtransaction": {1},
+    "testmempoolaccept": {0, 1},
+    "sendrawtransaction": {1, 2},
+}
+
+
+# Format an RPC result like bitcoin-cli: JSON indented by 2, amounts exactly as the node
+# sent them (0.00001000, not 1e-05) and non-ASCII text unescaped.
+def format_cli_json(value, indent: str = "") -> str:
+    if isinstance(value, Decimal):
+        return format(value, "f")
+    inner = indent + "  "
+    if isinstance(value, dict):
+        if not value:
+            return "{}"
+        items = [f"{inner}{json.dumps(key, ensure_ascii=False)}: {format_cli_json(item, inner)}" for key, item in value.items()]
+        return "{\n" + ",\n".join(items) + "\n" + indent + "}"
+    if isinstance(value, list):
+        if not value:
+            return "[]"
+        return "[\n" + ",\n".join(inner + format_cli_json(item, inner) for item in value) + "\n" + indent + "]"
+    return json.dumps(value, ensure_ascii=False)
+
+
 # Assuming Bitcoin Core is running and connected to signet using default datadir,
-# execute an RPC and return its value or error message.
+# execute an RPC and return its value or error message, formatted like bitcoin-cli prints it.
+# Arguments at the positions in BCLI_JSON_ARGS are parsed as JSON, the rest are sent as strings.
 # https://github.com/bitcoin/bitcoin/blob/master/doc/bitcoin-conf.md#configuration-file-path
 # Examples: bcli("getblockcount")
 #           bcli("getblockhash 100")
 def bcli(cmd: str):
-    res = run(
-            ["bitcoin-cli", "-signet"] + cmd.split(" "),
-            capture_output=True,
-            encoding="utf-8")
-    if res.returncode == 0:
-        return res.stdout.strip()
-    else:
-        raise Exception(res.stderr.strip())
+    method, *args = cmd.split(" ")
+    json_args = BCLI_JSON_ARGS.get(method, ())
+    params = [json.loads(arg, parse_float=Decimal) if position in json_args else arg
+              for position, arg in enumerate(args)]
+    result = get_rpc_client().call(method, *params)
+    if isinstance(result, str):
+        return result
+    return format_cli_json(result)
 
 # DESCRIPTOR="wpkh(tprv8ZgxMBicQKsPf4ey4o4mdpUh3AYy7JA5vySudZ8boXjFhYYjJ9TrP5FPiqhiAh8jPcPi4zMJ2FkdPgnzXDogMy8uoEAWDBVDrRAzyz8J7Dz/84h/1h/0h/0/*)#2d6m058e"
 def parse_path_from_descriptor(descriptor: str) -> List[Tuple[int, bool]]:
@@ -172,10 +594,72 @@ def parse_xpriv_from_descriptor(descriptor: str) -> str:
         index += 1
     return xprv
 
-# Recover the wallet state from the blockchain:
-# - Parse xprv and path from descriptor and derive 2000 key pairs and witness programs
-# - Request blocks 0-310 from Bitcoin Core via RPC and scan all transactions
-# - Return a state object with all the derived keys and total wallet balance
+# Map every witness program of the wallet to its key index, so the scanner matches outputs
+# with a dict lookup instead of a list search, and every program and public key (hex) to its
+# private key, so spend.py finds signing keys without recomputing public keys.
+# States saved before these indexes existed get them by calling this again.
+def index_keys(state: dict):
+    state["program_index"] = {program: index for index, program in enumerate(state["programs"])}
+    # older checkpoints also kept a public key index, which nothing reads since the utxo index
+    state.pop("pub_index", None)
+    # empty for a watch-only wallet
+    privs = state["privs"] or []
+    state["program_privs"] = dict(zip(state["programs"], privs))
+    state["pub_privs"] = dict(zip(state["pubs"], privs))
+
+
+# Derive the next count keys of a branch (0 external, 1 internal) and append them to the wallet's
+# key lists and indexes. Return the programs and public keys (hex) that were added.
+def add_keys(state: dict, branch: int, count: int) -> Tuple[List[str], List[str]]:
+    info = state["branches"][branch]
+    privs, pubs, programs = derive_wallet_keys(state["key"], state["chaincode"],
+                                               info["path"] + [(info["derived"], False)], count)
+    pubs_hex = [pub.hex() for pub in pubs]
+    programs_hex = [program.hex() for program in programs]
+    for offset in range(count):
+        state["program_index"][programs_hex[offset]] = len(state["programs"])
+        state["paths"].append((branch, info["derived"] + offset))
+        state["programs"].append(programs_hex[offset])
+        state["pubs"].append(pubs_hex[offset])
+        if privs is not None:
+            state["privs"].append(privs[offset])
+            state["program_privs"][programs_hex[offset]] = privs[offset]
+            state["pub_privs"][pubs_hex[offset]] = privs[offset]
+    info["derived"] += count
+    return programs_hex, pubs_hex
+
+
+# Name a wallet in errors by its number among the recovered wallets and its descriptor
+def wallet_name(state: dict) -> str:
+    return f"wallet {state.get('wallet', 0)} ({state['descriptor']})"
+
+
+# Map the programs (hex) to the state of the wallet that owns them. A program can have only
+# one owner, the scan would credit its coins to a single wallet, so raise a ValueError naming
+# both wallets if another one already owns it.
+def add_program_owners(program_owners: Dict[bytes, dict], programs: List[str], state: dict):
+    for program in map(bytes.fromhex, programs):
+        owner = program_owners.setdefault(program, state)
+        if owner is not state:
+            raise ValueError(f"Program {program.hex()} of {wallet_name(state)} "
+                             f"is already owned by {wallet_name(owner)}")
+
+
+# Keep GAP_LIMIT unused keys derived after the last used key of every branch, as BIP44 asks,
+# and add new programs to the owner map of the scanner. Return True if any keys were derived.
+def extend_lookahead(state: dict, program_owners: Dict[bytes, dict] = None) -> bool:
+    extended = False
+    for branch, info in state["branches"].items():
+        while info["derived"] < info["used"] + 1 + GAP_LIMIT:
+            programs, pubs = add_keys(state, branch, GAP_LIMIT)
+            if program_owners is not None:
+                add_program_owners(program_owners, programs, state)
+            extended = True
+    return extended
+
+
+# Parse the descriptor and derive the first GAP_LIMIT keys of its external /0/* branch and of
+# the matching internal /1/* branch. Return a fresh state object that has not scanned any block yet.
 # data_dict = {
 #     "version": b[:4],
 #     "depth": b[4],
@@ -184,72 +668,420 @@ def parse_xpriv_from_descriptor(descriptor: str) -> str:
 #     "chain_code": b[13:45],
 #     "key": b[45:],
 # }
-def recover_wallet_state(xprv: str):
-    path = parse_path_from_descriptor(DESCRIPTOR)
-
-    path.append((0, False)) # add to parsing function
+def derive_wallet_state(descriptor: str) -> dict:
+    path = parse_path_from_descriptor(descriptor)
 
-    xprv = base58_decode(parse_xpriv_from_descriptor(DESCRIPTOR))
+    xprv = base58_decode(parse_xpriv_from_descriptor(descriptor))
 
     des_key = deserialize_key(xprv)
 
     if (des_key["key"][0] == 0):
         des_key["key"] = des_key["key"][1:]
 
-    privs = get_wallet_privs(des_key['key'], des_key['chain_code'], path)
-
-    pubs_hex = []
-    programs_hex = []
-    for priv in privs:
-        pub = get_pub_from_priv(priv)
-        pubs_hex.append(pub.hex())
-        programs_hex.append(get_p2wpkh_program(pub).hex())
+    # the descriptor's own branch is the external one, /0 is paired with the internal /1
+    branches = {0: {"path": path, "derived": 0, "used": -1}}
+    if path and path[-1] == ("0", False):
+        branches[1] = {"path": path[:-1] + [("1", False)], "derived": 0, "used": -1}
 
     state = {
-        "utxo": {},
+        "descriptor": descriptor,
         "balance": 0,
-        "privs": privs,
-        "pubs": pubs_hex,
-        "programs": programs_hex
+        "key": des_key["key"],
+        "chaincode": des_key["chain_code"],
+        "branches": branches,
+        # privs stays None for a watch-only descriptor with an extended public key
+        "privs": [] if len(des_key["key"]) == 32 else None,
+        "pubs": [],
+        "programs": [],
+        # (branch, index) of every key
+        "paths": [],
     }
+    index_keys(state)
+    extend_lookahead(state)
+    reset_scan(state)
+    return state
+
+
+# Forget every scanned block, the next scan starts from genesis.
+def reset_scan(state: dict):
+    # the wallet's coins are the ones of wallet number state["wallet"] in its UtxoIndex
+    state["utxo"] = UtxoIndex()
+    state["wallet"] = 0
+    # hash of every scanned block by height, the last one is the checkpoint
+    state["block_hashes"] = []
+    # changes of the last MAX_REORG_DEPTH blocks to the utxo pool, to undo them on a reorg
+    state["undo"] = []
+
+
+# Unspent outputs of one or more wallets keyed by outpoint: the 32-byte txid in wire order
+# followed by the 4-byte little endian vout, as input_from_utxo in spend.py serializes it.
+# Every coin is a slot in compact arrays holding its wallet number, its value in satoshis and
+# the index of its key in that wallet's programs, pubs and privs (the script is programs[key]),
+# instead of a list and a dict of its own. Spent slots are reused, and the balance of every
+# wallet is kept up to date on add and spend so it never has to be summed.
+class UtxoIndex:
+    __slots__ = ("slots", "outpoints", "wallets", "values", "keys", "free", "balances")
+
+    def __init__(self):
+        self.slots = {}
+        # outpoint of every slot, None for a free one
+        self.outpoints = []
+        self.wallets = array("L")
+        self.values = array("q")
+        self.keys = array("L")
+        self.free = []
+        self.balances = array("q")
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, outpoint) -> bool:
+        return outpoint in self.slots
+
+    # Return the (wallet, key, value) of an unspent outpoint, None if it is not one of ours
+    def get(self, outpoint):
+        slot = self.slots.get(outpoint)
+        if slot is None:
+            return None
+        return self.wallets[slot], self.keys[slot], self.values[slot]
+
+    # Store a coin of wallet, return the (wallet, key, value) it replaced at the same outpoint or None
+    def add(self, outpoint: bytes, wallet: int, key: int, value: int):
+        previous = self.spend(outpoint) if outpoint in self.slots else None
+        while wallet >= len(self.balances):
+            self.balances.append(0)
+        if self.free:
+            slot = self.free.pop()
+            self.outpoints[slot] = outpoint
+            self.wallets[slot] = wallet
+            self.values[slot] = value
+            self.keys[slot] = key
+        else:
+            slot = len(self.outpoints)
+            self.outpoints.append(outpoint)
+            self.wallets.append(wallet)
+            self.values.append(value)
+            self.keys.append(key)
+        self.slots[outpoint] = slot
+        self.balances[wallet] += value
+        return previous
+
+    # Remove an unspent outpoint and return its (wallet, key, value)
+    def spend(self, outpoint):
+        slot = self.slots.pop(outpoint)
+        self.outpoints[slot] = None
+        self.free.append(slot)
+        self.balances[self.wallets[slot]] -= self.values[slot]
+        return self.wallets[slot], self.keys[slot], self.values[slot]
+
+    # Total value in satoshis of the unspent coins of wallet
+    def balance(self, wallet: int) -> int:
+        return self.balances[wallet] if wallet < len(self.balances) else 0
+
+    # Yield the (txid, vout, value, key) of every unspent coin of wallet, txid as hex like the RPC shows it
+    def coins(self, wallet: int):
+        for outpoint, slot in self.slots.items():
+            if self.wallets[slot] == wallet:
+                yield outpoint[31::-1].hex(), int.from_bytes(outpoint[32:], "little"), self.values[slot], self.keys[slot]
+
+
+# Apply the transactions of one block to the utxo index of one or more wallets.
+# program_owners maps our witness programs (bytes) to the state of the wallet they belong to,
+# so all wallets are matched with one dict lookup per output. Inputs are spends of ours
+# when their outpoint is in the index, whatever their witness holds.
+# The programs of received outputs are appended to received if it is given.
+# Return the changes as (outpoint, previous (wallet, key, value) or None) to undo them later.
+def scan_block(txs: list, program_owners: Dict[bytes, dict], utxo: UtxoIndex, received: list = None) -> list:
+    changes = []
+    # Scan every tx in every block
+    for tx in txs:
+        # # Check every tx output for our own witness programs.
+        # # These are coins we have received.
+        txid = None
+        for out in tx["vout"]:
+            scriptPubKey = out.get("scriptPubKey")
+            scPubKeyHex = scriptPubKey.get("hex")
+            state = program_owners.get(bytes.fromhex(scPubKeyHex)) if scPubKeyHex != None else None
+            if state is not None:
+                if txid is None:
+                    txid = bytes.fromhex(tx["txid"])[::-1]
+                value_satoshis = int(out["value"] * 100000000)
+                outpoint = txid + out["n"].to_bytes(4, "little")
+                changes.append((outpoint, utxo.add(outpoint, state["wallet"], state["program_index"][scPubKeyHex],
+                                                   value_satoshis)))
+                if received is not None:
+                    received.append(bytes.fromhex(scPubKeyHex))
+
+        # # Check every tx input for the outpoints of our coins.
+        # # These are coins we have spent.
+        for inp in tx["vin"]:
+            # coinbase inputs spend no outpoint
+            if "txid" in inp:
+                outpoint = bytes.fromhex(inp["txid"])[::-1] + inp["vout"].to_bytes(4, "little")
+                if outpoint in utxo:
+                    # Remove this coin from our wallet state utxo pool
+                    # so we don't double spend it later
+                    changes.append((outpoint, utxo.spend(outpoint)))
+    return changes
+
+
+# Wrap a serialized block from getblock <hash> 0 for scan_raw_block, with the hashes the scan checks
+def raw_block(block_hex: str) -> dict:
+    raw = memoryview(bytes.fromhex(block_hex))
+    return {
+        "hash": hashlib.sha256(hashlib.sha256(raw[:80]).digest()).digest()[::-1].hex(),
+        "previousblockhash": raw[4:36][::-1].hex(),
+        "raw": raw,
+    }
+
 
-    height = 310
-    for h in range(height + 1):
-        txs = json.loads(bcli(f"getblock {bcli(f'getblockhash {h}')} 2"), parse_float=Decimal)["tx"]
-        # Scan every tx in every block
-        for tx in txs:
-            # # Check every tx output for our own witness programs.
-            # # These are coins we have received.
-            for out in tx["vout"]:
-                scriptPubKey = out.get("scriptPubKey")
-                scPubKeyHex = scriptPubKey.get("hex")
-                if scPubKeyHex != None and scPubKeyHex in programs_hex:
-                    # state["balance"] += out["value"]
-                    value_satoshis = int(out["value"] * 100000000)
-                    state["utxo"][tx["txid"]] = [out["n"], value_satoshis, out]
-
-            # # Check every tx input (witness) for our own compressed public keys.
-            # # These are coins we have spent.
-            for inp in tx["vin"]:
-                txinwitness = inp.get("txinwitness")
-                if txinwitness != None and len(txinwitness) > 1:
-                    if txinwitness[1] in pubs_hex:
-                        if inp.get("txid") in state["utxo"]:
-                            if (inp.get("vout") == state["utxo"][inp.get("txid")][0]):
-                                del state["utxo"][inp.get("txid")]
-
-            # Remove this coin from our wallet state utxo pool
-            # so we don't double spend it later
-            # Add to our total balance
-    for txid, out in state["utxo"].items():
-        state["balance"] += out[1]
-    state["balance"] = state["balance"] / 100000000.0
+# Apply a serialized block to the utxo index like scan_block does with a verbose one.
+# The transactions are parsed in place from the memoryview, in the BIP144 wire format that
+# assemble_transaction in spend.py writes:
+# output scripts and input outpoints are looked up in the owner map and the index as
+# memoryview slices, and only transactions that pay us are copied to compute their txid.
+# https://github.com/bitcoin/bips/blob/master/bip-0144.mediawiki#serialization
+def scan_raw_block(raw: memoryview, program_owners: Dict[bytes, dict], utxo: UtxoIndex,
+                   received: list = None) -> list:
+    changes = []
+    tx_count, offset = read_compact_size(raw, 80)
+    for _ in range(tx_count):
+        start = offset
+        offset += 4
+        # segwit transactions have the marker 0x00 and the flag 0x01 after the version
+        segwit = raw[offset] == 0
+        if segwit:
+            offset += 2
+        body = offset
+        input_count, offset = read_compact_size(raw, offset)
+        spent = []
+        for _ in range(input_count):
+            outpoint = raw[offset:offset + 36]
+            if outpoint in utxo:
+                spent.append(outpoint.tobytes())
+            script_length, offset = read_compact_size(raw, offset + 36)
+            offset += script_length + 4
+        output_count, offset = read_compact_size(raw, offset)
+        payments = []
+        for n in range(output_count):
+            value = int.from_bytes(raw[offset:offset + 8], 'little')
+            script_length, offset = read_compact_size(raw, offset + 8)
+            script = raw[offset:offset + script_length]
+            offset += script_length
+            state = program_owners.get(script)
+            if state is not None:
+                payments.append((state, n, value, script.tobytes()))
+        body_end = offset
+        if segwit:
+            for _ in range(input_count):
+                item_count, offset = read_compact_size(raw, offset)
+                for _ in range(item_count):
+                    item_length, offset = read_compact_size(raw, offset)
+                    offset += item_length
+        offset += 4
+
+        # # These are coins we have received.
+        if payments:
+            if segwit:
+                stripped = b"".join((raw[start:start + 4], raw[body:body_end], raw[offset - 4:offset]))
+            else:
+                stripped = raw[start:offset]
+            txid = hashlib.sha256(hashlib.sha256(stripped).digest()).digest()
+            for state, n, value, script in payments:
+                outpoint = txid + n.to_bytes(4, "little")
+                changes.append((outpoint, utxo.add(outpoint, state["wallet"], state["program_index"][script.hex()], value)))
+                if received is not None:
+                    received.append(script)
+
+        # # These are coins we have spent.
+        for outpoint in spent:
+            changes.append((outpoint, utxo.spend(outpoint)))
+    return changes
+
+
+# Put back the utxo entries that changes replaced or removed, latest change first
+def undo_changes(utxo: UtxoIndex, changes: list):
+    for outpoint, previous in reversed(changes):
+        if outpoint in utxo:
+            utxo.spend(outpoint)
+        if previous is not None:
+            utxo.add(outpoint, *previous)
+
+
+# Scan a verbose or raw block with scan_block or scan_raw_block, and whenever it pays a key within
+# GAP_LIMIT of the end of its branch's derived keys, derive more keys and scan the block again,
+# so later outputs of the same block to the new keys are found too. Return the changes of the final scan.
+def scan_block_with_lookahead(block: dict, program_owners: Dict[bytes, dict], utxo: UtxoIndex) -> list:
+    while True:
+        received = []
+        if "raw" in block:
+            changes = scan_raw_block(block["raw"], program_owners, utxo, received)
+        else:
+            changes = scan_block(block["tx"], program_owners, utxo, received)
+        extended = False
+        for program in received:
+            state = program_owners[program]
+            branch, index = state["paths"][state["program_index"][program.hex()]]
+            info = state["branches"][branch]
+            info["used"] = max(info["used"], index)
+            extended = extend_lookahead(state, program_owners) or extended
+        if not extended:
+            return changes
+        undo_changes(utxo, changes)
+
+
+# Set the wallet balance in BTC from the running total of its utxo index
+def update_balance(state: dict):
+    state["balance"] = state["utxo"].balance(state["wallet"]) / 100000000.0
+
+
+# Undo the scanned blocks above height, return False if they go deeper than the kept undo data.
+def rollback(state: dict, height: int) -> bool:
+    blocks = len(state["block_hashes"]) - 1 - height
+    if blocks > len(state["undo"]):
+        return False
+    for _ in range(blocks):
+        undo_changes(state["utxo"], state["undo"].pop())
+        state["block_hashes"].pop()
+    return True
+
+
+# Return the height of the last scanned block that is still in the active chain, -1 if none is.
+def find_fork_height(rpc: RpcClient, block_hashes: List[str]) -> int:
+    height = min(len(block_hashes) - 1, rpc.call("getblockcount"))
+    while height >= 0:
+        low = max(0, height - RPC_BATCH_SIZE + 1)
+        chain_hashes = rpc.batch([("getblockhash", [h]) for h in range(low, height + 1)])
+        for h in range(height, low - 1, -1):
+            if chain_hashes[h - low] == block_hashes[h]:
+                return h
+        height = low - 1
+    return -1
+
+
+def load_checkpoint(checkpoint: str, descriptor: str):
+    try:
+        with open(checkpoint, "rb") as f:
+            state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    # states saved before checkpoints, gap-limit derivation or the utxo index existed are rescanned
+    if (state.get("descriptor") != descriptor or "block_hashes" not in state or "branches" not in state
+            or not isinstance(state.get("utxo"), UtxoIndex)):
+        return None
+    if "program_privs" not in state or "pub_index" in state:
+        index_keys(state)
+    return state
+
+
+# Write to a temporary file first so a crash never leaves a torn checkpoint
+def save_checkpoint(checkpoint: str, state: dict):
+    with open(checkpoint + ".tmp", "wb") as f:
+        pickle.dump(state, f)
+    os.replace(checkpoint + ".tmp", checkpoint)
+
+
+# Recover the wallet state from the blockchain:
+# - Parse xprv and path from descriptor and derive key pairs and witness programs,
+#   GAP_LIMIT past the last used key of the external and the internal branch
+# - Request blocks 0-height from Bitcoin Core via RPC and scan all transactions
+# - Return a state object with all the derived keys and total wallet balance
+# With a checkpoint file the keys and the utxo pool of the last run are loaded from it and only
+# new blocks are scanned. Blocks that were reorganized out of the chain are undone first.
+# With use_filters only blocks whose BIP158 filter matches one of our programs are downloaded,
+# with raw_blocks they are downloaded serialized and parsed by scan_raw_block instead of as JSON.
+def recover_wallet_state(xprv: str, height: int = 310, checkpoint: str = None, use_filters: bool = False,
+                         raw_blocks: bool = False):
+    state = load_checkpoint(checkpoint, DESCRIPTOR) if checkpoint else None
+    if state is None:
+        state = derive_wallet_state(DESCRIPTOR)
+
+    rpc = get_rpc_client()
+    while True:
+        fork_height = find_fork_height(rpc, state["block_hashes"]) if state["block_hashes"] else -1
+        if not rollback(state, fork_height):
+            reset_scan(state)
+        program_owners = dict.fromkeys(map(bytes.fromhex, state["programs"]), state)
+        reorged = False
+        heights = range(len(state["block_hashes"]), height + 1)
+        if use_filters:
+            blocks = fetch_matching_blocks(rpc, heights, program_owners, raw_blocks)
+        else:
+            blocks = fetch_blocks(rpc, heights, raw_blocks)
+        for block in blocks:
+            # the chain changed under the prefetched blocks, find the new fork point
+            if state["block_hashes"] and block.get("previousblockhash") != state["block_hashes"][-1]:
+                reorged = True
+                break
+            state["undo"].append(scan_block_with_lookahead(block, program_owners, state["utxo"]))
+            del state["undo"][:-MAX_REORG_DEPTH]
+            state["block_hashes"].append(block["hash"])
+        if not reorged:
+            break
+
+    update_balance(state)
+    if checkpoint:
+        save_checkpoint(checkpoint, state)
     # print(state["balance"])
-    # for txid, out in state["utxo"].items():
-    #     print(f"{out[2]}")
+    # for txid, vout, value, key in state["utxo"].coins(state["wallet"]):
+    #     print(f"{txid}:{vout} {value} {state['programs'][key]}")
     return state
 
+# Read the "name: descriptor" lines of a wallets.txt as exported by signet-setup.py
+def parse_wallets_file(path: str) -> List[Tuple[str, str]]:
+    wallets = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                name, descriptor = line.split(":", 1)
+                wallets.append((name.strip(), descriptor.strip()))
+    return wallets
+
+
+# Recover many wallets at once: derive their keys and programs across worker processes,
+# then scan blocks 0-height a single time for all of them through one shared script index
+# into one shared utxo index, where every wallet is numbered by its position.
+# Two wallets deriving the same program are a ValueError, as is the same descriptor twice.
+# Return the wallet states in the order of the descriptors.
+def recover_wallets_state(descriptors: List[str], height: int = 310, workers: int = None,
+                          use_filters: bool = False, raw_blocks: bool = False) -> List[dict]:
+    with ProcessPoolExecutor(workers) as executor:
+        states = list(executor.map(derive_wallet_state, descriptors, chunksize=max(1, len(descriptors) // 64)))
+    utxo = UtxoIndex()
+    program_owners = {}
+    for wallet, state in enumerate(states):
+        state["utxo"] = utxo
+        state["wallet"] = wallet
+        add_program_owners(program_owners, state["programs"], state)
+    rpc = get_rpc_client()
+    if use_filters:
+        blocks = fetch_matching_blocks(rpc, range(height + 1), program_owners, raw_blocks)
+    else:
+        blocks = fetch_blocks(rpc, range(height + 1), raw_blocks)
+    for block in blocks:
+        scan_block_with_lookahead(block, program_owners, utxo)
+    for state in states:
+        update_balance(state)
+    return states
+
+
 # bitcoin-cli scantxoutset "start" '["wpkh(tprv8ZgxMBicQKsPf4ey4o4mdpUh3AYy7JA5vySudZ8boXjFhYYjJ9TrP5FPiqhiAh8jPcPi4zMJ2FkdPgnzXDogMy8uoEAWDBVDrRAzyz8J7Dz/84h/1h/0h/0/*)#2d6m058e"]'
 #   "total_amount": 16.01713376 probably?
 if __name__ == "__main__":
-    print(f"{WALLET_NAME} {recover_wallet_state(EXTENDED_PRIVATE_KEY)['balance']}")
+    parser = argparse.ArgumentParser(description="Print the signet balance of our wallet")
+    parser.add_argument("--wallets", help="print the balance of every wallet in a wallets.txt file instead")
+    parser.add_argument("--workers", type=int, default=None, help="key derivation processes for --wallets")
+    parser.add_argument("--filters", action="store_true",
+                        help="download only blocks whose BIP158 filter matches, needs -blockfilterindex=1")
+    parser.add_argument("--raw", action="store_true", help="parse serialized blocks instead of verbose JSON")
+    args = parser.parse_args()
+    if args.wallets:
+        wallets = parse_wallets_file(args.wallets)
+        states = recover_wallets_state([descriptor for _, descriptor in wallets], workers=args.workers,
+                                       use_filters=args.filters, raw_blocks=args.raw)
+        for (name, _), state in zip(wallets, states):
+            print(f"{name} {state['balance']}")
+    else:
+        state = recover_wallet_state(EXTENDED_PRIVATE_KEY, checkpoint=CHECKPOINT_FILE, use_filters=args.filters,
+                                     raw_blocks=args.raw)
+        print(f"{WALLET_NAME} {state['balance']}")
@@ -0,0 +1,64 @@
+"""Compare the secp256k1 backends of ecc.py on public keys and signatures per second.
+
+Examples:
+    python benchmark.py
+    python benchmark.py --count 5000 --backends python ecdsa --output ecc.json
+"""
+import argparse
+import json
+import os
+import time
+
+import ecc
+
+
+# Return the calls per second of fn over every argument, the fastest of repeat runs
+def rate(fn, args, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for arg in args:
+            fn(*arg)
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return len(args) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the secp256k1 backends on pubkeys/sec and signs/sec")
+    parser.add_argument("--backends", nargs="+", choices=list(ecc.BACKENDS), help="default every installed backend")
+    parser.add_argument("--count", type=int, default=1000, help="random keys per run")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per operation, the fastest counts")
+    parser.add_argument("--output", help="also save the results as JSON at this path")
+    args = parser.parse_args()
+
+    names = args.backends or [name for name in ecc.BACKENDS if name != "coincurve" or ecc.coincurve is not None]
+    privs = [os.urandom(32) for _ in range(args.count)]
+    digests = [os.urandom(32) for _ in range(args.count)]
+    start = time.perf_counter()
+    ecc.generator_table()
+    print(f"python generator table: built in {time.perf_counter() - start:.3f}s, not part of the rates")
+    expected = [ecc.load_backend("python").sign(priv, digest) for priv, digest in zip(privs[:16], digests)]
+    results = {}
+    for name in names:
+        try:
+            backend = ecc.load_backend(name)
+        except ValueError as e:
+            parser.error(str(e))
+        signatures = [backend.sign(priv, digest) for priv, digest in zip(privs[:16], digests)]
+        results[name] = {
+            "pubkeys_per_second": rate(backend.pubkey, [(priv,) for priv in privs], args.repeat),
+            "signs_per_second": rate(backend.sign, list(zip(privs, digests)), args.repeat),
+            # RFC6979 and low-S make every backend produce the same bytes
+            "matches_python": signatures == expected,
+        }
+        result = results[name]
+        print(f"{name}: {result['pubkeys_per_second']:.0f} pubkeys/s, {result['signs_per_second']:.0f} signs/s"
+              f"{'' if result['matches_python'] else ', SIGNATURES DIFFER'}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"count": args.count, "repeat": args.repeat, "backends": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
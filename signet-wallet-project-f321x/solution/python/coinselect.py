@@ -0,0 +1,156 @@
+from typing import List, Optional, Tuple
+import math
+import random
+import time
+
+# Weight units of one input spending each output type, in the same format the signing
+# code in spend.py writes: outpoint (36), empty scriptSig (1) and sequence (4) count four
+# times, the witness once. Signatures are low-S DER of at most 71 bytes plus the sighash byte.
+# https://github.com/bitcoin/bips/blob/master/bip-0141.mediawiki#transaction-size-calculations
+INPUT_WEIGHTS = {
+    # 2 items: <sig> <33-byte pubkey>
+    "p2wpkh": 4 * 41 + 1 + (1 + 72) + (1 + 33),
+    # 4 items: <empty> <sig> <sig> <71-byte OP_2 <pub> <pub> OP_2 OP_CHECKMULTISIG>
+    "p2wsh_2of2": 4 * 41 + 1 + 1 + 2 * (1 + 72) + (1 + 71),
+}
+
+# Change smaller than this is added to the fee instead, like Bitcoin Core's CHANGE_LOWER
+MIN_CHANGE = 50000
+# Dust limit of a p2wpkh output at the default dust relay fee
+DUST = 294
+# Branch-and-bound gives up after this many steps, like Bitcoin Core's TOTAL_TRIES
+BNB_MAX_TRIES = 100000
+BNB_TIME_LIMIT = 1.0
+
+
+def compact_size_length(n: int) -> int:
+    return 1 if n < 0xfd else 3 if n <= 0xffff else 5 if n <= 0xffffffff else 9
+
+
+# Weight of an output with the given scriptPubKey: value, script length and script, no witness
+def output_weight(script: bytes) -> int:
+    return 4 * (8 + compact_size_length(len(script)) + len(script))
+
+
+# Weight of a segwit transaction: version, marker and flag, counts, inputs, outputs and locktime
+def transaction_weight(input_types: List[str], output_scripts: List[bytes]) -> int:
+    base = 4 * (4 + compact_size_length(len(input_types)) + compact_size_length(len(output_scripts)) + 4)
+    return (base + 2 + sum(INPUT_WEIGHTS[input_type] for input_type in input_types)
+            + sum(output_weight(script) for script in output_scripts))
+
+
+# Fee in satoshis of weight at feerate sat/vB, rounded up
+def fee_for(weight: int, feerate: float) -> int:
+    return math.ceil(weight * feerate / 4)
+
+
+# Search the coins, sorted by effective value from largest to smallest, for a set whose
+# effective values add up to between target and target + cost_of_change, so no change output
+# is needed and the excess given up as fee is smaller than making change would cost.
+# Depth first, every coin is tried included before excluded, and a branch is cut as soon
+# as it overshoots or even all the remaining coins cannot reach target. Coins with the same
+# value as one just excluded are skipped, they would repeat the same sums.
+# Return the indices of the set with the least excess, or None if there is none.
+# https://github.com/bitcoin/bitcoin/blob/master/src/wallet/coinselection.cpp (SelectCoinsBnB)
+def select_coins_bnb(values: List[int], target: int, cost_of_change: int, max_tries: int = BNB_MAX_TRIES,
+                     time_limit: float = BNB_TIME_LIMIT) -> Optional[List[int]]:
+    # remaining[i] is the value of coins i and after
+    remaining = [0] * (len(values) + 1)
+    for i in range(len(values) - 1, -1, -1):
+        remaining[i] = remaining[i + 1] + values[i]
+    if remaining[0] < target:
+        return None
+    upper = target + cost_of_change
+    deadline = time.perf_counter() + time_limit
+    best = None
+    best_excess = None
+    included = []
+    value = 0
+    index = 0
+    for tries in range(max_tries):
+        if tries & 1023 == 0 and time.perf_counter() > deadline:
+            break
+        backtrack = value + remaining[index] < target or value > upper
+        if not backtrack and value >= target:
+            if best is None or value - target < best_excess:
+                best = list(included)
+                best_excess = value - target
+                if best_excess == 0:
+                    break
+            backtrack = True
+        if backtrack:
+            if not included:
+                # every branch was explored
+                break
+            # exclude the last included coin and go on with the next different value
+            last = included.pop()
+            value -= values[last]
+            index = last + 1
+            while index < len(values) and values[index] == values[last]:
+                index += 1
+        else:
+            included.append(index)
+            value += values[index]
+            index += 1
+    return best
+
+
+# Pick coins in random order until they pay target plus a change output of at least
+# MIN_CHANGE, or at least DUST if the coins run out first.
+# Return the indices of the picked coins, or None if all of them do not reach target.
+# https://github.com/bitcoin/bitcoin/blob/master/src/wallet/coinselection.cpp (SelectCoinsSRD)
+def select_coins_srd(values: List[int], target: int, change_fee: int, rng: random.Random) -> Optional[List[int]]:
+    order = list(range(len(values)))
+    rng.shuffle(order)
+    picked = []
+    value = 0
+    for index in order:
+        picked.append(index)
+        value += values[index]
+        if value >= target + change_fee + MIN_CHANGE:
+            return picked
+    return picked if value >= target else None
+
+
+# Choose coins of the wallet's utxo index to pay outputs at feerate sat/vB.
+# coins are (txid, vout, value, key) as UtxoIndex.coins yields them, all of input_type,
+# payments are (scriptPubKey, value) pairs and change goes to change_script.
+# Every coin counts at its effective value, its value less the fee of spending it, so
+# coins that cost more than they are worth are never picked. Branch-and-bound looks for a
+# changeless set first, single random draw is the fallback and makes change.
+# Return a dict with the "coins", the "fee", the "change" value (0 for none) and the
+# "algorithm" that chose them, or None if the coins cannot pay for the outputs.
+def select_coins(coins: List[Tuple[str, int, int, int]], payments: List[Tuple[bytes, int]], feerate: float,
+                 change_script: bytes, input_type: str = "p2wpkh", time_limit: float = BNB_TIME_LIMIT,
+                 rng: random.Random = None) -> Optional[dict]:
+    input_fee = fee_for(INPUT_WEIGHTS[input_type], feerate)
+    pool = sorted((coin for coin in coins if coin[2] > input_fee), key=lambda coin: coin[2], reverse=True)
+    values = [coin[2] - input_fee for coin in pool]
+    amount = sum(value for _, value in payments)
+    # everything but the inputs, whose fees are already taken off their values,
+    # with the input count sized for the whole pool to stay on the safe side
+    base_weight = transaction_weight([], [script for script, _ in payments]) + 4 * (compact_size_length(len(pool)) - 1)
+    target = amount + fee_for(base_weight, feerate)
+    change_fee = fee_for(output_weight(change_script), feerate)
+    # making change costs its output now and spending it later
+    cost_of_change = change_fee + input_fee
+
+    selected = select_coins_bnb(values, target, cost_of_change, time_limit=time_limit)
+    if selected is not None:
+        algorithm = "bnb"
+        change = 0
+    else:
+        selected = select_coins_srd(values, target, change_fee, rng or random.Random())
+        if selected is None:
+            return None
+        algorithm = "srd"
+        change = sum(values[i] for i in selected) - target - change_fee
+        if change < DUST:
+            change = 0
+    chosen = [pool[i] for i in selected]
+    return {
+        "coins": chosen,
+        "fee": sum(coin[2] for coin in chosen) - amount - change,
+        "change": change,
+        "algorithm": algorithm,
+    }
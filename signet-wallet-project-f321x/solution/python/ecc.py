@@ -0,0 +1,201 @@
+from ecdsa import SECP256k1, SigningKey, util
+from functools import lru_cache
+from typing import Tuple
+import hashlib
+import hmac
+import os
+
+try:
+    import coincurve
+except ImportError:  # optional, bindings to Bitcoin Core's libsecp256k1
+    coincurve = None
+
+# secp256k1 domain parameters
+# https://www.secg.org/sec2-v2.pdf#subsubsection.2.4.1
+P = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEFFFFFC2F
+N = 0xFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFFEBAAEDCE6AF48A03BBFD25E8CD0364141
+G = (0x79BE667EF9DCBBAC55A06295CE870B07029BFCDB2DCE28D959F2815B16F81798,
+     0x483ADA7726A3C4655DA4FBFC0E1108A8FD17B448A68554199C47D08FFB10D4B8)
+
+# The generator table holds every byte multiple of G * 256^i, one row per byte of a scalar
+WINDOW_BITS = 8
+
+
+# Double a point in Jacobian coordinates (X, Y, Z) ~ (X/Z^2, Y/Z^3), None is the point at infinity
+# https://hyperelliptic.org/EFD/g1p/auto-shortw-jacobian-0.html#doubling-dbl-2009-l
+def jacobian_double(point):
+    if point is None or point[1] == 0:
+        return None
+    X, Y, Z = point
+    YY = Y * Y % P
+    S = 4 * X * YY % P
+    M = 3 * X * X % P
+    X3 = (M * M - 2 * S) % P
+    return X3, (M * (S - X3) - 8 * YY * YY) % P, 2 * Y * Z % P
+
+
+# Add an affine point (x, y) to a Jacobian one, which saves the multiplications by its Z
+# https://hyperelliptic.org/EFD/g1p/auto-shortw-jacobian-0.html#addition-madd-2007-bl
+def jacobian_add_affine(point, x: int, y: int):
+    if point is None:
+        return x, y, 1
+    X1, Y1, Z1 = point
+    Z1Z1 = Z1 * Z1 % P
+    H = (x * Z1Z1 - X1) % P
+    r = (y * Z1 * Z1Z1 - Y1) % P
+    if H == 0:
+        return jacobian_double(point) if r == 0 else None
+    HH = H * H % P
+    HHH = H * HH % P
+    V = X1 * HH % P
+    X3 = (r * r - HHH - 2 * V) % P
+    return X3, (r * (V - X3) - Y1 * HHH) % P, Z1 * H % P
+
+
+# Convert Jacobian points to affine (x, y) with a single modular inversion (Montgomery's trick)
+def to_affine(points: list) -> list:
+    products = []
+    product = 1
+    for X, Y, Z in points:
+        product = product * Z % P
+        products.append(product)
+    inverse = pow(product, -1, P)
+    affine = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        X, Y, Z = points[i]
+        z_inverse = inverse * products[i - 1] % P if i else inverse
+        inverse = inverse * Z % P
+        zz = z_inverse * z_inverse % P
+        affine[i] = (X * zz % P, Y * zz * z_inverse % P)
+    return affine
+
+
+# Precompute j * 256^i * G for every byte value j and every byte position i of a scalar,
+# so k * G takes one addition per nonzero byte of k and no doublings.
+# Built on first use, about 8000 additions.
+@lru_cache(maxsize=None)
+def generator_table() -> Tuple[list, ...]:
+    size = 1 << WINDOW_BITS
+    rows = []
+    base = G
+    for _ in range((256 + WINDOW_BITS - 1) // WINDOW_BITS):
+        multiples = []
+        point = None
+        for _ in range(size):
+            point = jacobian_add_affine(point, *base)
+            multiples.append(point)
+        # index 0 stays unused, the last multiple is the base of the next row
+        row = [None] + to_affine(multiples)
+        base = row.pop()
+        rows.append(row)
+    return tuple(rows)
+
+
+# Multiply the generator by a scalar with the precomputed table, return affine (x, y)
+def generator_multiply(k: int) -> Tuple[int, int]:
+    k %= N
+    if k == 0:
+        raise ValueError("The point at infinity has no affine coordinates")
+    point = None
+    for row, byte in zip(generator_table(), k.to_bytes(32, 'little')):
+        if byte:
+            point = jacobian_add_affine(point, *row[byte])
+    return to_affine([point])[0]
+
+
+# Derive an RFC6979 deterministic nonce from the private key and the message digest,
+# so signing needs no randomness and the same message always gives the same signature.
+# https://www.rfc-editor.org/rfc/rfc6979#section-3.2
+def rfc6979_nonce(secret: int, digest: bytes) -> int:
+    x = secret.to_bytes(32, 'big')
+    h = (int.from_bytes(digest, 'big') % N).to_bytes(32, 'big')
+    V = b'\x01' * 32
+    K = b'\x00' * 32
+    K = hmac.new(K, V + b'\x00' + x + h, hashlib.sha256).digest()
+    V = hmac.new(K, V, hashlib.sha256).digest()
+    K = hmac.new(K, V + b'\x01' + x + h, hashlib.sha256).digest()
+    V = hmac.new(K, V, hashlib.sha256).digest()
+    while True:
+        V = hmac.new(K, V, hashlib.sha256).digest()
+        k = int.from_bytes(V, 'big')
+        if 0 < k < N:
+            return k
+        K = hmac.new(K, V + b'\x00', hashlib.sha256).digest()
+        V = hmac.new(K, V, hashlib.sha256).digest()
+
+
+# Encode a signature in strict DER as BIP66 requires:
+# 0x30 [total-length] 0x02 [R-length] [R] 0x02 [S-length] [S]
+# https://github.com/bitcoin/bips/blob/master/bip-0066.mediawiki
+def der_encode(r: int, s: int) -> bytes:
+    def integer(value: int) -> bytes:
+        # minimal big endian, with a 0x00 pad when the top bit is set so it stays positive
+        data = value.to_bytes((value.bit_length() + 8) // 8, 'big')
+        return b'\x02' + bytes([len(data)]) + data
+    body = integer(r) + integer(s)
+    return b'\x30' + bytes([len(body)]) + body
+
+
+# Pure-Python backend on the precomputed generator table, always available
+class PythonBackend:
+    name = "python"
+
+    def pubkey(self, priv: bytes) -> bytes:
+        x, y = generator_multiply(int.from_bytes(priv, 'big'))
+        return bytes([2 + (y & 1)]) + x.to_bytes(32, 'big')
+
+    # ECDSA with an RFC6979 nonce, s is replaced by N - s if it is high (BIP62 low-S)
+    def sign(self, priv: bytes, digest: bytes) -> bytes:
+        secret = int.from_bytes(priv, 'big')
+        z = int.from_bytes(digest, 'big') % N
+        while True:
+            k = rfc6979_nonce(secret, digest)
+            r = generator_multiply(k)[0] % N
+            s = pow(k, -1, N) * (z + r * secret) % N
+            if r and s:
+                break
+            # negligibly unlikely, RFC6979 would continue its generator instead
+            digest = hashlib.sha256(digest).digest()
+        return der_encode(r, min(s, N - s))
+
+
+# The ecdsa package the scripts used before, kept to compare against
+class EcdsaBackend:
+    name = "ecdsa"
+
+    def pubkey(self, priv: bytes) -> bytes:
+        point = SECP256k1.generator * int.from_bytes(priv, 'big')
+        return bytes([2 + (point.y() & 1)]) + point.x().to_bytes(32, 'big')
+
+    def sign(self, priv: bytes, digest: bytes) -> bytes:
+        key = SigningKey.from_string(priv, curve=SECP256k1)
+        return key.sign_digest_deterministic(digest, hashfunc=hashlib.sha256, sigencode=util.sigencode_der_canonize)
+
+
+# libsecp256k1 through coincurve, which signs with RFC6979 nonces and low-S itself
+class CoincurveBackend:
+    name = "coincurve"
+
+    def pubkey(self, priv: bytes) -> bytes:
+        return coincurve.PublicKey.from_secret(priv).format(compressed=True)
+
+    def sign(self, priv: bytes, digest: bytes) -> bytes:
+        return coincurve.PrivateKey(priv).sign(digest, hasher=None)
+
+
+BACKENDS = {backend.name: backend for backend in (CoincurveBackend, PythonBackend, EcdsaBackend)}
+
+
+# Return the named backend, or the fastest one installed if name is None
+def load_backend(name: str = None):
+    if name is None:
+        name = "coincurve" if coincurve is not None else "python"
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown secp256k1 backend {name}, choose from {', '.join(BACKENDS)}")
+    if name == "coincurve" and coincurve is None:
+        raise ValueError("The coincurve backend needs pip install coincurve")
+    return BACKENDS[name]()
+
+
+# Used for every public key and signature, SECP256K1_BACKEND picks another one
+backend = load_backend(os.environ.get("SECP256K1_BACKEND"))
@@ -1,8 +1,10 @@
+from concurrent.futures import ProcessPoolExecutor
+import coinselect
+import ecc
 import hashlib
-import pickle # for state cache
-import os # for state cache
-from ecdsa import SigningKey, SECP256k1, util
-from typing import List
+import multiprocessing
+import os
+from typing import Dict, List, Tuple, Union
 from balance import (
     EXTENDED_PRIVATE_KEY,
     bcli,
@@ -12,17 +14,11 @@ from balance import (
     json)
 
 
-STATE_FILE = "state.pkl"
-
-if os.path.exists(STATE_FILE):
-    # Load the state from the file
-    with open(STATE_FILE, "rb") as f:
-        state = pickle.load(f)
-else:
-    # Get the state and save it to the file
-    state = recover_wallet_state(EXTENDED_PRIVATE_KEY)
-    with open(STATE_FILE, "wb") as f:
-        pickle.dump(state, f)
+STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "state.pkl")
+# fee rate in sat/vB, about what the old fixed 1000 sat fee paid for a 1-input 2-output spend
+FEERATE = 7
+# transactions with fewer inputs are signed in this process, a pool costs more than it saves
+PARALLEL_SIGN_MIN_INPUTS = 128
 
 # Given 2 compressed public keys as byte arrays, construct
 # a 2-of-2 multisig output script. No length byte prefix is necessary.
@@ -46,6 +42,23 @@ def get_p2wsh_program(script: bytes, version: int=0) -> bytes:
     # Prepend the version byte and return
     return version_byte + hash256
 
+# Serialize a count or a length as a CompactSize unsigned integer:
+# one byte below 0xfd, else a 0xfd, 0xfe or 0xff marker and 2, 4 or 8 little endian bytes
+# https://en.bitcoin.it/wiki/Protocol_documentation#Variable_length_integer
+def compact_size(n: int) -> bytes:
+    if n < 0xfd:
+        return n.to_bytes(1, "little")
+    if n <= 0xffff:
+        return b"\xfd" + n.to_bytes(2, "little")
+    if n <= 0xffffffff:
+        return b"\xfe" + n.to_bytes(4, "little")
+    return b"\xff" + n.to_bytes(8, "little")
+
+
+def dsha256(data: bytes) -> bytes:
+    return hashlib.new("sha256", hashlib.new("sha256", data).digest()).digest()
+
+
 # Given an outpoint, return a serialized transaction input spending it
 # Use hard-coded defaults for sequence and scriptSig
 def input_from_utxo(txid: bytes, index: int) -> bytes:
@@ -64,21 +77,16 @@ def input_from_utxo(txid: bytes, index: int) -> bytes:
 # Given an output script and value (in satoshis), return a serialized transaction output
 def output_from_options(script: bytes, value: int) -> bytes:
     value = value.to_bytes(8, "little")
-    script_length = len(script).to_bytes(1, "little")
+    script_length = compact_size(len(script))
     return value + script_length + script
 
-# Given a JSON utxo object, extract the public key hash from the output script
+# Given the p2wpkh witness program of a coin, extract the public key hash from it
 # and assemble the p2wpkh scriptcode as defined in BIP143
 # <script length> OP_DUP OP_HASH160 <pubkey hash> OP_EQUALVERIFY OP_CHECKSIG
 # https://github.com/bitcoin/bips/blob/master/bip-0143.mediawiki#specification
-def get_p2wpkh_scriptcode(utxo: object) -> bytes:
-    asm = utxo["scriptPubKey"]["asm"]
-    # Split the script into tokens
-    tokens = asm.split(" ")
-    # The last token is the pubkey hash
-    # print(utxo)
-    # print(tokens[-1], "tokens[-1]")
-    pubkey_hash = bytes.fromhex(tokens[-1])
+def get_p2wpkh_scriptcode(program: bytes) -> bytes:
+    # OP_0 <20 bytes>, the pubkey hash follows the version and the push byte
+    pubkey_hash = program[2:]
     # Assemble the scriptcode
     scriptcode = bytes.fromhex("1976a914") + pubkey_hash + bytes.fromhex("88ac")
     return scriptcode
@@ -89,11 +97,10 @@ def get_p2wpkh_scriptcode(utxo: object) -> bytes:
 #     print(utxo["scriptPubKey"]["asm"])
 
 
-# Compute the commitment hash for a single input and return bytes to sign.
-# This implements the BIP 143 transaction digest algorithm
+# Compute the parts of the BIP 143 transaction digest that are the same for every input,
+# so a transaction with n inputs hashes its prevouts, sequences and outputs once instead of n times.
+# Return the SHA256 state after the first three fields (the midstate) and hashOutputs.
 # https://github.com/bitcoin/bips/blob/master/bip-0143.mediawiki#specification
-# We assume only a single input and two outputs,
-# as well as constant default values for sequence and locktime
 #   Double SHA256 of the serialization of:
 #      1. nVersion of the transaction (4-byte little endian)
 #      2. hashPrevouts (32-byte hash)
@@ -105,62 +112,66 @@ def get_p2wpkh_scriptcode(utxo: object) -> bytes:
 #      8. hashOutputs (32-byte hash)
 #      9. nLocktime of the transaction (4-byte little endian)
 #     10. sighash type of the signature (4-byte little endian)
-def get_commitment_hash(outpoint: bytes, scriptcode: bytes, value: int, outputs: List[bytes]) -> bytes:
-    def dsha256(data: bytes) -> bytes:
-        return hashlib.new("sha256", hashlib.new("sha256", data).digest()).digest()
-    result = b""
+# We assume constant default values for sequence and locktime
+def get_sighash_midstate(outpoints: List[bytes], outputs: List[bytes]) -> Tuple[object, bytes]:
     # Version
-    result += (2).to_bytes(4, "little")
-# https://discord.com/channels/1188115495346507797/1198656875961532416/1202045448164999258
-    # printf "302e0201010420 <privkey_hex> a00706052b8104000a" | xxd -p -r > priv.hex
-# openssl ec -inform d < priv.hex > priv.pem
-# printf <hex_msg> | xxd -p -r | sha256sum | xxd -p -r | sha256sum | xxd -p -r > msg
-# openssl pkeyutl -inkey priv.pem -sign -in msg -pkeyopt digest:sha256 | xxd -p -c256
-    # All TX input outpoints (only one in our case)
-    result += dsha256(outpoint)  # hashPrevouts
-    # All TX input sequences (only one for us, always default value)
-    result += dsha256(bytes.fromhex("ffffffff"))
+    midstate = hashlib.new("sha256", (2).to_bytes(4, "little"))
+    # All TX input outpoints
+    midstate.update(dsha256(b"".join(outpoints)))  # hashPrevouts
+    # All TX input sequences (always default value for us)
+    midstate.update(dsha256(bytes.fromhex("ffffffff") * len(outpoints)))  # hashSequence
+    # hashOutputs is the double SHA256
+    # of the serialization of all output amount (8-byte little endian)
+    # with scriptPubKey (serialized as scripts inside CTxOuts)
+    # https://discord.com/channels/1188115495346507797/1198656875961532416/1200194030533869659
+    return midstate, dsha256(b"".join(outputs))
+
+
+# Compute the commitment hash of one input from the transaction's cached midstate
+# and return bytes to sign. Only the input's own fields are hashed here.
+def get_input_commitment_hash(sighash_midstate: Tuple[object, bytes], outpoint: bytes, scriptcode: bytes,
+                              value: int) -> bytes:
+    midstate, hash_outputs = sighash_midstate
+    result = midstate.copy()
     # Single outpoint being spent (32-byte hash + 4-byte little endian)
-    result += outpoint
+    result.update(outpoint)
     # length prefix see hint
     # Scriptcode (the scriptPubKey in/implied by the output being spent, see BIP 143) (serialized as scripts inside CTxOuts)
     # Passed scriptcode: scriptcode = bytes.fromhex("1976a914") + pubkey_hash + bytes.fromhex("88ac")
     # The scriptcode in the transaction commitment must be prefixed with a length byte, but the witness program only commits to the raw script with no length byte
-
     if len(scriptcode) > 30:
-        result += len(scriptcode).to_bytes(1, "little") + scriptcode
+        result.update(compact_size(len(scriptcode)) + scriptcode)
     else:
-        result += scriptcode
-
+        result.update(scriptcode)
     # Value of output being spent (8-byte little endian)
-    result += value.to_bytes(8, "little")
+    result.update(value.to_bytes(8, "little"))
     # Sequence of output being spent (always default for us) (4-byte little endian)
-    result += bytes.fromhex("ffffffff")
-    # All TX outputs (4-byte little endian)
-    # hashOutputs is the double SHA256
-    # of the serialization of all output amount (8-byte little endian)
-    # with scriptPubKey (serialized as scripts inside CTxOuts)
-    # https://discord.com/channels/1188115495346507797/1198656875961532416/1200194030533869659
-    result += dsha256(b"".join(outputs))
+    result.update(bytes.fromhex("ffffffff"))
+    result.update(hash_outputs)
     # Locktime (always default for us) (4-byte little endian)
-    result += bytes.fromhex("00000000")
+    result.update(bytes.fromhex("00000000"))
     # SIGHASH_ALL (always default for us) (4-byte little endian)
-    result += bytes.fromhex("01000000")
-    # print(result.hex())
-    return dsha256(result)
+    result.update(bytes.fromhex("01000000"))
+    return hashlib.new("sha256", result.digest()).digest()
+
 
-# Given a JSON utxo object and a list of all of our wallet's witness programs,
+# Compute the commitment hash for a transaction with a single input and return bytes to sign.
+# This implements the BIP 143 transaction digest algorithm
+# https://github.com/bitcoin/bips/blob/master/bip-0143.mediawiki#specification
+# https://discord.com/channels/1188115495346507797/1198656875961532416/1202045448164999258
+# printf "302e0201010420 <privkey_hex> a00706052b8104000a" | xxd -p -r > priv.hex
+# openssl ec -inform d < priv.hex > priv.pem
+# printf <hex_msg> | xxd -p -r | sha256sum | xxd -p -r | sha256sum | xxd -p -r > msg
+# openssl pkeyutl -inkey priv.pem -sign -in msg -pkeyopt digest:sha256 | xxd -p -c256
+def get_commitment_hash(outpoint: bytes, scriptcode: bytes, value: int, outputs: List[bytes]) -> bytes:
+    return get_input_commitment_hash(get_sighash_midstate([outpoint], outputs), outpoint, scriptcode, value)
+
+# Given a JSON utxo object and our wallet's index of witness programs (state["program_index"]),
 # return the index of the derived key that can spend the coin.
 # This index should match the corresponding private key in our wallet's list.
-def get_key_index(utxo: object, programs: List[str]) -> int:
-    # Get the pubkey hash from the output script
-    asm = utxo["scriptPubKey"]["asm"]
-    # Split the script into tokens
-    tokens = asm.split(" ")
-    # The last token is the pubkey hash
-    pubkey_hash = tokens[-1]
-    # Find the index of the pubkey hash in our list of witness programs
-    return programs.index(pubkey_hash)
+def get_key_index(utxo: object, program_index: Dict[str, int]) -> int:
+    # The output script is the witness program itself
+    return program_index[utxo["scriptPubKey"]["hex"]]
 
 
 # Given a private key and message digest as bytes, compute the ECDSA signature.
@@ -169,26 +180,15 @@ def get_key_index(utxo: object, programs: List[str]) -> int:
 # - Must have the SIGHASH_ALL byte (0x01) appended
 # - Must have a low s value as defined by BIP 62:
 #   https://github.com/bitcoin/bips/blob/master/bip-0062.mediawiki#user-content-Low_S_values_in_signatures
+# Every ecc backend signs with an RFC6979 nonce and returns a strict-DER low-S signature,
+# so there is no need to decode it and negate a high s value here.
 def sign(priv: bytes, msg: bytes) -> bytes:
-    # Create a signing object from the private key
-    sk = SigningKey.from_string(priv, curve=SECP256k1)
     # Sign the message digest
-    sig = sk.sign_digest(msg, sigencode=util.sigencode_der_canonize)
+    sig = ecc.backend.sign(priv, msg)
     # Append the SIGHASH_ALL byte
-    # Decode the DER-encoded signature
-    # vk = sk.get_verifying_key()
-    r, s = util.sigdecode_der(sig, SECP256k1.order)
-    # Extract the s value
-    # If the s value is too high, negate it
-    if s > SECP256k1.order // 2:
-        s = SECP256k1.order - s
-    # Re-encode the signature
-    sig = util.sigencode_der(r, s, SECP256k1.order)
+    # Format: 0x30 [total-length] 0x02 [R-length] [R] 0x02 [S-length] [S] [sighash]
     sig += bytes.fromhex("01")
     return sig
-    # Keep signing until we produce a signature with "low s value"
-    # We will have to decode the DER-encoded signature and extract the s value to check it
-    # Format: 0x30 [total-length] 0x02 [R-length] [R] 0x02 [S-length] [S] [sighash]
 
 
 # Given a private key and  p2transaction commitment hash to sign,
@@ -239,6 +239,27 @@ def get_p2wsh_witness(privs: List[bytes], msg: bytes) -> bytes:
     return witness
 
 
+# Sign one input: a single private key gets a p2wpkh witness, a list of keys a multisig p2wsh one
+def sign_input(job: Tuple[Union[bytes, List[bytes]], bytes]) -> bytes:
+    privs, msg = job
+    if isinstance(privs, bytes):
+        return get_p2wpkh_witness(privs, msg)
+    return get_p2wsh_witness(privs, msg)
+
+
+# Sign a batch of (private key or keys, commitment hash) jobs, one per input, and return the
+# witnesses in input order. Large batches are signed in forked worker processes, which share
+# the wallet state and the generator table instead of starting over as spawned ones would.
+# The signatures are deterministic (RFC6979), so the result is the same as signing serially.
+def sign_inputs(jobs: List[Tuple[Union[bytes, List[bytes]], bytes]], workers: int = None) -> List[bytes]:
+    if workers == 1 or len(jobs) < PARALLEL_SIGN_MIN_INPUTS or "fork" not in multiprocessing.get_all_start_methods():
+        return [sign_input(job) for job in jobs]
+    if isinstance(ecc.backend, ecc.PythonBackend):
+        ecc.generator_table()
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        return list(executor.map(sign_input, jobs, chunksize=max(1, len(jobs) // (8 * (workers or 4)))))
+
+
 # Given arrays of inputs, outputs, and witnesses, assemble the complete
 # transaction and serialize it for broadcast. Return bytes as hex-encoded string
 # suitable to broadcast with Bitcoin Core RPC.
@@ -248,13 +269,14 @@ def assemble_transaction(inputs: List[bytes], outputs: List[bytes], witnesses: L
     marker = bytes.fromhex("00")
     flag = bytes.fromhex("01")
     locktime = bytes.fromhex("00000000")
-    tx = b""
-    tx += version + marker + flag + len(inputs).to_bytes(1, "little")
+    # a bytearray grows in place, appending hundreds of inputs to bytes would copy it every time
+    tx = bytearray()
+    tx += version + marker + flag + compact_size(len(inputs))
     for input in inputs:
         tx += input
         # tx += len(witnesses[0]).to_bytes(1, "little") + witnesses[0]
 
-    tx += len(outputs).to_bytes(1, "little")
+    tx += compact_size(len(outputs))
     for output in outputs:
         tx += output
 
@@ -270,56 +292,56 @@ def assemble_transaction(inputs: List[bytes], outputs: List[bytes], witnesses: L
 def get_txid(inputs: List[bytes], outputs: List[bytes]) -> str:
     version = (2).to_bytes(4, "little")
     locktime = bytes.fromhex("00000000")
-    tx = b""
-    tx += version + len(inputs).to_bytes(1, "little")
+    tx = bytearray()
+    tx += version + compact_size(len(inputs))
     for input in inputs:
         tx += input
-    tx += len(outputs).to_bytes(1, "little")
+    tx += compact_size(len(outputs))
     for output in outputs:
         tx += output
     tx += locktime
     return hashlib.new("sha256", hashlib.new("sha256", tx).digest()).digest()[::-1].hex()
 
 
-def get_correct_priv_key(all_privs: List[bytes], witness_prog: str) -> bytes:
-    for priv in all_privs:
-        pub = get_pub_from_priv(priv)
-        # print(f"witness: {get_p2wpkh_program(pub).hex()} | given: {witness_prog}")
-        if witness_prog == get_p2wpkh_program(pub).hex():
-            # print("priv found")
-            return priv
+# Given the wallet's map of witness programs to private keys (state["program_privs"]),
+# built once with the keys and saved with the state, return the key of a program or None
+def get_correct_priv_key(program_privs: Dict[str, bytes], witness_prog: str) -> bytes:
+    return program_privs.get(witness_prog)
+
+# Same for a public key (hex) and the wallet's state["pub_privs"]
+def get_priv_from_pubkey(pub_privs: Dict[str, bytes], pubkey: str) -> bytes:
+    return pub_privs.get(pubkey)
+
+# Given coins as dicts with "txid", "op_index", "value_sats", "program" and "priv_key"
+# and serialized outputs, sign every input with a p2wpkh witness and return (txid, final hex).
+# The midstate of the transaction is hashed once and shared by the commitment hashes
+# of all inputs, so each further input costs one signature and a constant amount of hashing.
+# The signatures are made by sign_inputs, across workers processes for many inputs.
+def build_p2wpkh_transaction(coins: List[dict], outputs: List[bytes], workers: int = None) -> Tuple[str, str]:
+    outpoints = []
+    serialized_inputs = []
+    for coin in coins:
+        # Reverse the txid hash so it's little-endian
+        op, serialized_input = input_from_utxo(bytes.fromhex(coin["txid"]), coin["op_index"])
+        outpoints.append(op)
+        serialized_inputs.append(serialized_input)
+    sighash_midstate = get_sighash_midstate(outpoints, outputs)
+    jobs = []
+    for coin, op in zip(coins, outpoints):
+        # Get the message to sign
+        scriptcode = get_p2wpkh_scriptcode(coin["program"])
+        msg = get_input_commitment_hash(sighash_midstate, op, scriptcode, coin["value_sats"])
+        jobs.append((coin["priv_key"], msg))
+    # Sign!
+    witnesses = sign_inputs(jobs, workers)
+    # Reserialize without witness data and double-SHA256 to get the txid
+    txid = get_txid(serialized_inputs, outputs)
+    return txid, assemble_transaction(serialized_inputs, outputs, witnesses)
 
-def get_priv_from_pubkey(all_privs: List[bytes], pubkey: str) -> bytes:
-    for priv in all_privs:
-        pub = get_pub_from_priv(priv)
-        if pubkey == pub.hex():
-            # print("priv found")
-            return priv
 
 # Spend a p2wpkh utxo to a 2 of 2 multisig p2wsh and return the txid
 def spend_p2wpkh(state: object) -> str:
-    FEE = 1000
     AMT = 1000000
-    input = {}
-    index = 0
-
-    # Choose an unspent coin worth more than 0.01 BTC
-    for txid, utxo in state["utxo"].items():
-        if utxo[1] > AMT + FEE and utxo[1] > 9090283:
-            input['txid'] = txid  # txid
-            input['op_index'] = utxo[0]  # outpoint index
-            input['value_sats'] = utxo[1]  # value in satoshis
-            input['utxo_obj'] = utxo[2]   # utxo object
-            input['priv_key'] = get_correct_priv_key(state["privs"], utxo[2]["scriptPubKey"]["hex"])
-            break
-        index += 1
-    if (not input["priv_key"]):
-        print("no key found")
-        return
-
-    # Create the input from the utxo
-    # Reverse the txid hash so it's little-endian
-    op, serialized_input = input_from_utxo(bytes.fromhex(input['txid']), input["op_index"])
 
     # Compute destination output script and output
     pubkeys = [bytes.fromhex(state["pubs"][0]), bytes.fromhex(state["pubs"][1])]
@@ -330,25 +352,30 @@ def spend_p2wpkh(state: object) -> str:
 
     output_musig = output_from_options(scriptPubKey, AMT)
 
-    # Compute change output script and output
+    # Choose the coins that pay 0.01 BTC and the fee at FEERATE, without change if possible
     change_script = get_p2wpkh_program(bytes.fromhex(state["pubs"][0]))
-    change_output = output_from_options(change_script, input["value_sats"] - AMT - FEE)
-
-    # Get the message to sign
-    scriptcode = get_p2wpkh_scriptcode(input["utxo_obj"])
-    # print(input["txid"])
-    # print(input["op_index"])
-    msg = get_commitment_hash(op, scriptcode, input["value_sats"], [output_musig, output_from_options(change_script, input["value_sats"] - AMT - FEE)])
-
-    # Fetch the private key we need to sign with
-    # Sign!
-    witness = get_p2wpkh_witness(input["priv_key"], msg)
+    selection = coinselect.select_coins(list(state["utxo"].coins(state["wallet"])), [(scriptPubKey, AMT)],
+                                        FEERATE, change_script)
+    if selection is None:
+        print("insufficient funds")
+        return
+    inputs = []
+    for txid, vout, value, key in selection["coins"]:
+        inputs.append({
+            "txid": txid,
+            "op_index": vout,  # outpoint index
+            "value_sats": value,  # value in satoshis
+            "program": bytes.fromhex(state["programs"][key]),  # witness program
+            "priv_key": get_correct_priv_key(state["program_privs"], state["programs"][key]),
+        })
 
-    # Assemble
-    final = assemble_transaction([serialized_input], [output_musig, change_output], [witness])
+    # Compute change output script and output
+    outputs = [output_musig]
+    if selection["change"]:
+        outputs.append(output_from_options(change_script, selection["change"]))
 
-    # Reserialize without witness data and double-SHA256 to get the txid
-    txid = get_txid([serialized_input], [output_musig, change_output])
+    # Sign and assemble
+    txid, final = build_p2wpkh_transaction(inputs, outputs)
     # For debugging you can use RPC `testmempoolaccept ["<final hex>"]` here
     return txid, final
 
@@ -367,7 +394,6 @@ def spend_p2wpkh(state: object) -> str:
 # Serialize the final transaction and return the hex encoded string.
 def spend_p2wsh(state: object, txid: str) -> str:
     COIN_VALUE = 1000000
-    FEE = 1000
     AMT = 0
     NAME = "f321x"
     # input_utxo = json.loads(bcli(f"decoderawtransaction {tx1_hex} true"))["vout"][0]
@@ -387,6 +413,8 @@ def spend_p2wsh(state: object, txid: str) -> str:
     # Compute change output script and output
     # print(state["pubs"][0])
     change_script = get_p2wpkh_program(bytes.fromhex(state["pubs"][0]))
+    # the fee at FEERATE for the weight of this multisig input and the two outputs
+    FEE = coinselect.fee_for(coinselect.transaction_weight(["p2wsh_2of2"], [op_return_script, change_script]), FEERATE)
     change_output = output_from_options(change_script, COIN_VALUE - AMT - FEE)
 
     # Get the message to sign
@@ -399,7 +427,7 @@ def spend_p2wsh(state: object, txid: str) -> str:
     msg = get_commitment_hash(op, orig_musig_script, COIN_VALUE, [output_op_return, change_output])
 
     # Sign!
-    privs = [get_priv_from_pubkey(state["privs"], state["pubs"][0]), get_priv_from_pubkey(state["privs"], state["pubs"][1])]
+    privs = [get_priv_from_pubkey(state["pub_privs"], state["pubs"][0]), get_priv_from_pubkey(state["pub_privs"], state["pubs"][1])]
     # print("privs", privs[0].hex(), privs[1].hex())
     witness = get_p2wsh_witness(privs, msg)
     # print(witness.hex())
@@ -414,7 +442,9 @@ def spend_p2wsh(state: object, txid: str) -> str:
 # https://mempool.btcfoss.bitherding.com/
 if __name__ == "__main__":
     # Recover wallet state: We will need all key pairs and unspent coins
-    # state = recover_wallet_state(EXTENDED_PRIVATE_KEY)
+    # Resume the wallet scan from the checkpoint in the state cache, which is saved back
+    # with the new blocks. Caches written before checkpoints existed are rescanned once.
+    state = recover_wallet_state(EXTENDED_PRIVATE_KEY, checkpoint=STATE_FILE)
     txid1, tx1 = spend_p2wpkh(state)
     # print("txid1 ", txid1)
     print(tx1)
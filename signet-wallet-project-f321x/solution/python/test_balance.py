@@ -0,0 +1,473 @@
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import base64
+import hashlib
+import json
+import threading
+
+import pytest
+
+import balance
+
+AUTH = "user:pass"
+
+
+# Serve JSON-RPC on a free local port from a thread. respond(handler, body) returns the
+# (status, reply) for a decoded request body. Returns a client for it and the server's stats.
+@pytest.fixture
+def stub_node():
+    servers = []
+
+    def start(respond, auth=AUTH):
+        stats = {"connections": 0, "requests": []}
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                stats["connections"] += 1
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                if self.headers.get("Authorization") != "Basic " + base64.b64encode(auth.encode()).decode():
+                    self.send_response(401)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+                request = json.loads(body)
+                stats["requests"].append(request)
+                status, reply = respond(self, request)
+                # bytes are sent as they are, to control how numbers are written
+                data = reply if isinstance(reply, bytes) else json.dumps(reply).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return balance.RpcClient("127.0.0.1", server.server_address[1], AUTH), stats
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+# Answer single and batch requests with methods[name](*params), errors as Bitcoin Core sends them
+def rpc_responder(methods):
+    def answer(request):
+        try:
+            return {"result": methods[request["method"]](*request["params"]), "error": None, "id": request["id"]}
+        except KeyError:
+            return {"result": None, "error": {"code": -32601, "message": "Method not found"}, "id": request["id"]}
+
+    def respond(handler, request):
+        if isinstance(request, list):
+            return 200, [answer(call) for call in request]
+        reply = answer(request)
+        return (500 if reply["error"] else 200), reply
+    return respond
+
+
+# Golomb-Rice code scripts into a BIP158 basic filter for the block, the inverse of gcs_match
+def encode_filter(block_hash: str, scripts):
+    key = bytes.fromhex(block_hash)[::-1]
+    k0 = int.from_bytes(key[0:8], 'little')
+    k1 = int.from_bytes(key[8:16], 'little')
+    items = sorted(set(scripts))
+    f = len(items) * balance.BASIC_FILTER_M
+    bits = []
+    last = 0
+    for value in sorted((balance.siphash24(k0, k1, script) * f) >> 64 for script in items):
+        delta, last = value - last, value
+        bits += [1] * (delta >> balance.BASIC_FILTER_P) + [0]
+        bits += [delta >> i & 1 for i in range(balance.BASIC_FILTER_P - 1, -1, -1)]
+    bits += [0] * (-len(bits) % 8)
+    data = bytes(int("".join(map(str, bits[i:i + 8])), 2) for i in range(0, len(bits), 8))
+    return bytes([len(items)]) + data
+
+
+def test_siphash24_reference_vector():
+    key = bytes(range(16))
+    k0 = int.from_bytes(key[0:8], 'little')
+    k1 = int.from_bytes(key[8:16], 'little')
+    assert balance.siphash24(k0, k1, b"") == 0x726fdb47dd0e0e31
+    assert balance.siphash24(k0, k1, bytes(range(15))) == 0xa129ca6149be45e5
+
+
+# https://github.com/bitcoin/bips/blob/master/bip-0158/testnet-19.json, block 0
+def test_gcs_match_testnet_genesis_filter():
+    block_hash = "000000000933ea01ad0ee984209779baaec3ced90fa3f408719526f8d77f4943"
+    block_filter = bytes.fromhex("019dfca8")
+    coinbase_script = bytes.fromhex("4104678afdb0fe5548271967f1a67130b7105cd6a828e03909a67962e0ea1f61deb649f6bc"
+                                    "3f4cef38c4f35504e51ec112de5c384df7ba0b8d578a4c702b6bf11d5fac")
+    other_program = b"\x00\x14" + hashlib.new("ripemd160", b"not in the genesis block").digest()
+    assert balance.gcs_match(block_filter, block_hash, [coinbase_script])
+    assert balance.gcs_match(block_filter, block_hash, [other_program, coinbase_script])
+    assert not balance.gcs_match(block_filter, block_hash, [other_program])
+
+
+def test_gcs_match_decodes_every_element():
+    block_hash = hashlib.sha256(b"block").hexdigest()
+    scripts = [hashlib.sha256(b"%d" % i).digest()[:22] for i in range(200)]
+    block_filter = encode_filter(block_hash, scripts)
+    assert all(balance.gcs_match(block_filter, block_hash, [script]) for script in scripts)
+    assert not balance.gcs_match(block_filter, block_hash, [b"\x00\x14" + bytes(20)])
+    with pytest.raises(ValueError):
+        balance.gcs_match(block_filter[:-3], block_hash, [b"\x00\x14" + bytes(20)])
+
+
+def test_fetch_matching_blocks_downloads_only_matching_blocks(stub_node):
+    ours = b"\x00\x14" + bytes(range(20))
+    hashes = [hashlib.sha256(b"block %d" % height).hexdigest() for height in range(40)]
+    heights = {block_hash: height for height, block_hash in enumerate(hashes)}
+    paying = {3, 17, 18, 39}
+
+    def block_scripts(height):
+        scripts = [hashlib.sha256(b"other %d %d" % (height, i)).digest()[:22] for i in range(5)]
+        return scripts + [ours] if height in paying else scripts
+
+    def header(block_hash):
+        height = heights[block_hash]
+        return {"hash": block_hash, "height": height, "previousblockhash": hashes[height - 1] if height else None}
+
+    client, stats = stub_node(rpc_responder({
+        "getblockhash": lambda height: hashes[height],
+        "getblockheader": header,
+        "getblockfilter": lambda block_hash, kind: {
+            "filter": encode_filter(block_hash, block_scripts(heights[block_hash])).hex()},
+        "getblock": lambda block_hash, verbosity: dict(header(block_hash), tx=["paid"]),
+    }))
+    blocks = list(balance.fetch_matching_blocks(client, range(40), {ours: None}, batch_size=8))
+    assert [block["hash"] for block in blocks] == hashes
+    assert [height for height, block in enumerate(blocks) if block["tx"]] == sorted(paying)
+    downloaded = [request["params"][0] for request in stats["requests"]
+                  if isinstance(request, dict) and request["method"] == "getblock"]
+    assert sorted(heights[block_hash] for block_hash in downloaded) == sorted(paying)
+
+
+def test_rpc_client_reuses_connections_and_retries_one_closed_by_the_node(stub_node):
+    calls = []
+
+    def respond(handler, request):
+        calls.append(request["method"])
+        # the first reply keeps the connection open for the client, then the node drops it
+        if len(calls) == 1:
+            handler.close_connection = True
+        return 200, {"result": len(calls), "error": None, "id": request["id"]}
+
+    client, stats = stub_node(respond)
+    assert client.call("getblockcount") == 1
+    assert client.call("getblockcount") == 2
+    assert client.call("getblockcount") == 3
+    # one connection for the first call, one fresh one for the retry that is then kept alive
+    assert stats["connections"] == 2
+    assert calls == ["getblockcount"] * 3
+
+
+def test_rpc_client_batch_orders_results_by_id(stub_node):
+    def respond(handler, request):
+        replies = [{"result": call["params"][0] * 10, "error": None, "id": call["id"]} for call in request]
+        return 200, replies[::-1]
+
+    client, _ = stub_node(respond)
+    assert client.batch([("getblockhash", [height]) for height in range(5)]) == [0, 10, 20, 30, 40]
+    assert client.batch([]) == []
+
+
+def test_rpc_client_rejected_credentials(stub_node):
+    client, _ = stub_node(rpc_responder({"getblockcount": lambda: 1}), auth="user:other")
+    with pytest.raises(balance.RpcError, match="authorization"):
+        client.call("getblockcount")
+
+
+def test_rpc_client_raises_rpc_errors_with_their_code(stub_node):
+    def out_of_range(height):
+        raise KeyError(height)
+
+    client, _ = stub_node(rpc_responder({"getblockhash": out_of_range}))
+    with pytest.raises(balance.RpcError) as error:
+        client.call("getblockhash", 10**6)
+    assert error.value.code == -32601
+    with pytest.raises(balance.RpcError) as error:
+        client.batch([("getblockhash", [1]), ("nosuchmethod", [])])
+    assert error.value.code == -32601
+
+
+def test_bcli_converts_arguments_and_prints_amounts_like_bitcoin_cli(stub_node, monkeypatch):
+    def respond(handler, request):
+        if request["method"] == "getbalances":
+            return 200, b'{"result": {"mine": {"trusted": 0.00001000, "untrusted_pending": 0E-8}}, "error": null, "id": 0}'
+        return 200, {"result": request["params"], "error": None, "id": request["id"]}
+
+    client, stats = stub_node(respond)
+    monkeypatch.setattr(balance, "rpc_client", client)
+    assert balance.bcli("getblockhash 100") == "[\n  100\n]"
+    assert json.loads(balance.bcli("getblock 00ff 2")) == ["00ff", 2]
+    # only the known positions are JSON, labels that look like numbers or booleans stay strings
+    assert json.loads(balance.bcli("setlabel tb1qaddress 123")) == ["tb1qaddress", "123"]
+    assert json.loads(balance.bcli("setlabel tb1qaddress true")) == ["tb1qaddress", "true"]
+    assert stats["requests"][0]["params"] == [100]
+    assert balance.bcli("getbalances") == (
+        '{\n  "mine": {\n    "trusted": 0.00001000,\n    "untrusted_pending": 0.00000000\n  }\n}')
+    assert balance.format_cli_json({"amount": Decimal("50.00000000"), "list": [], "text": "é"}) == (
+        '{\n  "amount": 50.00000000,\n  "list": [],\n  "text": "é"\n}')
+
+
+def test_recover_wallets_state_rejects_programs_owned_by_two_wallets():
+    with pytest.raises(ValueError, match=r"of wallet 1 \(.*\) is already owned by wallet 0 \("):
+        balance.recover_wallets_state([balance.DESCRIPTOR, balance.DESCRIPTOR], workers=1)
+
+
+def test_read_bitcoin_conf_takes_network_only_options_from_the_signet_section(tmp_path):
+    conf = tmp_path / "bitcoin.conf"
+    conf.write_text("rpcuser=alice\nrpcpassword=secret\nrpcport=8332\nrpcconnect=10.0.0.1\n"
+                    "[main]\nrpcport=8000\n[signet]\nrpcpassword=signet # comment\n")
+    assert balance.read_bitcoin_conf(str(conf)) == {"rpcuser": "alice", "rpcpassword": "signet"}
+    assert balance.find_rpc_auth(str(tmp_path), str(conf)) == ("127.0.0.1", balance.SIGNET_RPC_PORT, "alice:signet")
+    conf.write_text("rpcport=8332\n[signet]\nrpcport=40000\nrpcconnect=10.0.0.2\nrpcpassword=p\n")
+    assert balance.find_rpc_auth(str(tmp_path), str(conf)) == ("10.0.0.2", 40000, ":p")
+
+
+def dsha256(data: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+def compact_size(n: int) -> bytes:
+    return bytes([n]) if n < 0xfd else b"\xfd" + n.to_bytes(2, "little")
+
+
+# Serialize a transaction spending inputs, (txid, vout) pairs, or a coinbase with the given
+# scriptSig, to outputs, (script, sats) pairs. Return the wire format, BIP144 if segwit with
+# one dummy witness item per input, and the transaction as getblock <hash> 2 shows it.
+def make_tx(inputs, outputs, segwit=True, coinbase=None):
+    if coinbase is not None:
+        serialized_inputs = [bytes(32) + b"\xff" * 4 + compact_size(len(coinbase)) + coinbase + b"\xff" * 4]
+        vin = [{"coinbase": coinbase.hex(), "sequence": 0xffffffff}]
+    else:
+        serialized_inputs = [bytes.fromhex(txid)[::-1] + vout.to_bytes(4, "little") + b"\x00" + b"\xff" * 4
+                             for txid, vout in inputs]
+        vin = [{"txid": txid, "vout": vout} for txid, vout in inputs]
+    body = compact_size(len(serialized_inputs)) + b"".join(serialized_inputs)
+    body += compact_size(len(outputs)) + b"".join(sats.to_bytes(8, "little") + compact_size(len(script)) + script
+                                                   for script, sats in outputs)
+    version, locktime = (2).to_bytes(4, "little"), bytes(4)
+    txid = dsha256(version + body + locktime)[::-1].hex()
+    if segwit:
+        raw = version + b"\x00\x01" + body + b"".join(b"\x01\x48" + bytes(72) for _ in serialized_inputs) + locktime
+    else:
+        raw = version + body + locktime
+    vout = [{"value": sats / 100000000, "n": n, "scriptPubKey": {"hex": script.hex()}}
+            for n, (script, sats) in enumerate(outputs)]
+    return raw, {"txid": txid, "vin": vin, "vout": vout}
+
+
+class StubChain:
+    """Blocks served by the stub node, with the RPC methods the wallet scan calls."""
+
+    def __init__(self):
+        self.blocks = []
+        # every block ever mined by hash, reorganized ones too
+        self.by_hash = {}
+        self.scripts = {}
+
+    def mine(self, txs=(), tag=b""):
+        height = len(self.blocks)
+        previous = self.blocks[-1]["hash"] if self.blocks else None
+        coinbase = make_tx(None, [(OTHER_SCRIPT, 5000000000)], segwit=False, coinbase=height.to_bytes(4, "little") + tag)
+        txs = [coinbase] + list(txs)
+        # BIP158 basic filters hold the output scripts and the scripts of the outputs spent
+        filter_scripts = set()
+        for _, tx in txs:
+            for out in tx["vout"]:
+                script = bytes.fromhex(out["scriptPubKey"]["hex"])
+                self.scripts[(tx["txid"], out["n"])] = script
+                filter_scripts.add(script)
+            # outpoints the chain never mined are someone else's coins
+            filter_scripts.update(self.scripts.get((vin["txid"], vin["vout"]), OTHER_SCRIPT)
+                                  for vin in tx["vin"] if "txid" in vin)
+        header = ((1).to_bytes(4, "little") + (bytes.fromhex(previous)[::-1] if previous else bytes(32))
+                  + dsha256(b"".join(bytes.fromhex(tx["txid"]) for _, tx in txs)) + bytes(12))
+        block_hash = dsha256(header)[::-1].hex()
+        block = {
+            "hash": block_hash,
+            "height": height,
+            "previousblockhash": previous,
+            "raw": header + compact_size(len(txs)) + b"".join(raw for raw, _ in txs),
+            "tx": [tx for _, tx in txs],
+            "filter": encode_filter(block_hash, filter_scripts),
+        }
+        self.blocks.append(block)
+        self.by_hash[block_hash] = block
+        return [tx for _, tx in txs[1:]]
+
+    def reorg(self, fork_height):
+        """Drop the blocks above fork_height, the next mined block forks off there."""
+        del self.blocks[fork_height + 1:]
+
+    def header(self, block_hash):
+        block = self.by_hash[block_hash]
+        return {"hash": block_hash, "height": block["height"], "previousblockhash": block["previousblockhash"]}
+
+    def getblock(self, block_hash, verbosity):
+        block = self.by_hash[block_hash]
+        if verbosity == 0:
+            return block["raw"].hex()
+        return dict(self.header(block_hash), tx=block["tx"])
+
+    def responder(self):
+        return rpc_responder({
+            "getblockcount": lambda: len(self.blocks) - 1,
+            "getblockhash": lambda height: self.blocks[height]["hash"],
+            "getblock": self.getblock,
+            "getblockheader": self.header,
+            "getblockfilter": lambda block_hash, kind: {"filter": self.by_hash[block_hash]["filter"].hex()},
+        })
+
+
+OTHER_SCRIPT = b"\x00\x14" + hashlib.new("ripemd160", b"someone else").digest()
+
+
+# Witness programs of the wallet by (branch, index), derived well past what any scan derives
+@pytest.fixture(scope="module")
+def wallet_programs():
+    state = balance.derive_wallet_state(balance.DESCRIPTOR)
+    state["branches"][0]["used"] = 80
+    state["branches"][1]["used"] = 10
+    balance.extend_lookahead(state)
+    return {path: bytes.fromhex(program) for path, program in zip(state["paths"], state["programs"])}
+
+
+# Mine blocks 0-11 paying the wallet in segwit and legacy transactions, with two spends of its
+# coins, payments to external keys 19, 35 and 50 that only the lookahead finds and one to
+# external key 95, which stays beyond it.
+@pytest.fixture
+def stub_chain(wallet_programs):
+    chain = StubChain()
+    chain.mine()
+    [a] = chain.mine([make_tx([(f"{1:064x}", 0)], [(wallet_programs[0, 0], 5000000), (OTHER_SCRIPT, 1000)])])
+    [b] = chain.mine([make_tx([(f"{2:064x}", 1)], [(OTHER_SCRIPT, 1), (wallet_programs[1, 3], 2500000),
+                                                    (wallet_programs[0, 19], 700000), (wallet_programs[0, 35], 100000)],
+                              segwit=False)])
+    chain.mine([make_tx([(a["txid"], 0)], [(wallet_programs[0, 50], 1234567), (wallet_programs[0, 95], 999)])])
+    chain.mine()
+    chain.mine()
+    chain.mine([make_tx([(f"{3:064x}", 0)], [(wallet_programs[0, 1], 42000)])])
+    chain.mine()
+    chain.mine([make_tx([(b["txid"], 1), (f"{4:064x}", 2)], [(OTHER_SCRIPT, 2400000)])])
+    for _ in range(3):
+        chain.mine()
+    return chain
+
+
+def getblock_heights(chain, stats):
+    heights = {block_hash: block["height"] for block_hash, block in chain.by_hash.items()}
+    return sorted(heights[call["params"][0]] for request in stats["requests"]
+                  for call in (request if isinstance(request, list) else [request]) if call["method"] == "getblock")
+
+
+def recover(client, monkeypatch, height, **kwargs):
+    monkeypatch.setattr(balance, "rpc_client", client)
+    state = balance.recover_wallet_state(balance.EXTENDED_PRIVATE_KEY, height=height, **kwargs)
+    return state["balance"], sorted(state["utxo"].coins(state["wallet"]))
+
+
+@pytest.mark.parametrize("raw_blocks, use_filters", [(False, False), (True, False), (False, True), (True, True)])
+def test_resume_from_checkpoint_matches_a_cold_scan(stub_node, stub_chain, monkeypatch, tmp_path,
+                                                    raw_blocks, use_filters):
+    client, stats = stub_node(stub_chain.responder())
+    cold = recover(client, monkeypatch, 11, raw_blocks=raw_blocks, use_filters=use_filters)
+    assert cold[0] == (700000 + 100000 + 1234567 + 42000) / 100000000
+    checkpoint = str(tmp_path / "checkpoint.pkl")
+    recover(client, monkeypatch, 5, checkpoint=checkpoint, raw_blocks=raw_blocks, use_filters=use_filters)
+    stats["requests"].clear()
+    assert recover(client, monkeypatch, 11, checkpoint=checkpoint, raw_blocks=raw_blocks, use_filters=use_filters) == cold
+    assert set(getblock_heights(stub_chain, stats)) <= set(range(6, 12))
+
+
+def test_reorg_below_the_checkpoint_is_rolled_back(stub_node, stub_chain, monkeypatch, tmp_path, wallet_programs):
+    client, stats = stub_node(stub_chain.responder())
+    checkpoint = str(tmp_path / "checkpoint.pkl")
+    recover(client, monkeypatch, 11, checkpoint=checkpoint)
+    # the payment to external key 1 at height 6 is replaced by one to key 2 at height 7
+    stub_chain.reorg(5)
+    stub_chain.mine(tag=b"fork")
+    stub_chain.mine([make_tx([(f"{5:064x}", 0)], [(wallet_programs[0, 2], 1111)])], tag=b"fork")
+    for _ in range(5):
+        stub_chain.mine(tag=b"fork")
+    stats["requests"].clear()
+    resumed = recover(client, monkeypatch, 12, checkpoint=checkpoint)
+    # rolled back to the fork point at height 5, not rescanned
+    assert getblock_heights(stub_chain, stats) == list(range(6, 13))
+    cold = recover(client, monkeypatch, 12)
+    assert resumed == cold
+    # the spend of the internal coin at height 8 was reorganized out too
+    assert cold[0] == (2500000 + 700000 + 100000 + 1234567 + 1111) / 100000000
+
+
+def test_reorg_deeper_than_the_undo_data_rescans(stub_node, stub_chain, monkeypatch, tmp_path):
+    client, stats = stub_node(stub_chain.responder())
+    checkpoint = str(tmp_path / "checkpoint.pkl")
+    monkeypatch.setattr(balance, "MAX_REORG_DEPTH", 2)
+    recover(client, monkeypatch, 11, checkpoint=checkpoint)
+    stub_chain.reorg(1)
+    for _ in range(11):
+        stub_chain.mine(tag=b"fork")
+    stats["requests"].clear()
+    resumed = recover(client, monkeypatch, 11, checkpoint=checkpoint)
+    assert getblock_heights(stub_chain, stats) == list(range(12))
+    assert resumed == recover(client, monkeypatch, 11)
+    assert resumed[0] == 0.05
+
+
+def test_payments_near_the_end_of_the_lookahead_extend_it(stub_node, stub_chain, monkeypatch, wallet_programs):
+    client, _ = stub_node(stub_chain.responder())
+    monkeypatch.setattr(balance, "rpc_client", client)
+    state = balance.recover_wallet_state(balance.EXTENDED_PRIVATE_KEY, height=11)
+    external, internal = state["branches"][0], state["branches"][1]
+    assert external["used"] == 50 and external["derived"] >= 50 + 1 + balance.GAP_LIMIT
+    assert internal["used"] == 3 and internal["derived"] >= 3 + 1 + balance.GAP_LIMIT
+    assert wallet_programs[0, 95].hex() not in state["program_index"]
+    paid = {state["paths"][key]: value for _, _, value, key in state["utxo"].coins(state["wallet"])}
+    assert paid == {(0, 19): 700000, (0, 35): 100000, (0, 50): 1234567, (0, 1): 42000}
+
+
+def test_scan_raw_block_matches_scan_block(stub_node, stub_chain):
+    client, _ = stub_node(stub_chain.responder())
+    states = []
+    for raw in (False, True):
+        state = balance.derive_wallet_state(balance.DESCRIPTOR)
+        program_owners = dict.fromkeys(map(bytes.fromhex, state["programs"]), state)
+        changes = [balance.scan_block_with_lookahead(block, program_owners, state["utxo"])
+                   for block in balance.fetch_blocks(client, range(12), raw)]
+        states.append((changes, sorted(state["utxo"].coins(0)), state["utxo"].balance(0)))
+    assert states[0] == states[1]
+    assert sum(map(len, states[0][0])) == 8
+
+
+def test_utxo_index_keeps_balances_and_reuses_slots():
+    utxo = balance.UtxoIndex()
+    outpoints = [bytes([i]) * 32 + (i).to_bytes(4, "little") for i in range(4)]
+    assert utxo.add(outpoints[0], 0, 5, 1000) is None
+    assert utxo.add(outpoints[1], 2, 7, 300) is None
+    assert (utxo.balance(0), utxo.balance(1), utxo.balance(2), utxo.balance(9)) == (1000, 0, 300, 0)
+    assert utxo.spend(outpoints[0]) == (0, 5, 1000)
+    assert utxo.add(outpoints[2], 0, 6, 50) is None
+    # the spent coin's slot is reused
+    assert len(utxo.outpoints) == 2 and len(utxo) == 2
+    assert utxo.add(outpoints[2], 1, 8, 70) == (0, 6, 50)
+    assert (utxo.balance(0), utxo.balance(1)) == (0, 70)
+    assert outpoints[2] in utxo and outpoints[0] not in utxo
+    assert list(utxo.coins(1)) == [(outpoints[2][31::-1].hex(), 2, 70, 8)]
+    changes = [(outpoints[3], utxo.add(outpoints[3], 1, 9, 5)), (outpoints[1], utxo.spend(outpoints[1]))]
+    balance.undo_changes(utxo, changes)
+    assert utxo.get(outpoints[1]) == (2, 7, 300) and utxo.get(outpoints[3]) is None
+    assert (utxo.balance(1), utxo.balance(2)) == (70, 300)
@@ -0,0 +1,127 @@
+from itertools import combinations
+import random
+
+import pytest
+
+import balance
+import coinselect
+import spend
+
+P2WPKH_SCRIPT = b"\x00\x14" + bytes(20)
+P2WSH_SCRIPT = b"\x00\x20" + bytes(32)
+
+
+def coins_of(values):
+    return [(f"{i:064x}", 0, value, i) for i, value in enumerate(values)]
+
+
+# The smallest excess over target of any subset within target + cost_of_change, or None
+def brute_force_excess(values, target, cost_of_change):
+    best = None
+    for size in range(1, len(values) + 1):
+        for subset in combinations(values, size):
+            excess = sum(subset) - target
+            if 0 <= excess <= cost_of_change and (best is None or excess < best):
+                best = excess
+    return best
+
+
+def test_bnb_finds_an_exact_match():
+    values = [90000, 70000, 50000, 30000, 20000, 10000]
+    selected = coinselect.select_coins_bnb(values, 80000, 0)
+    assert sum(values[i] for i in selected) == 80000
+    assert coinselect.select_coins_bnb(values, 80001, 0) is None
+    assert coinselect.select_coins_bnb(values, sum(values) + 1, 10**6) is None
+
+
+def test_bnb_matches_a_brute_force_search():
+    rng = random.Random(25)
+    for _ in range(300):
+        values = sorted((rng.randrange(1000, 100000) for _ in range(rng.randrange(1, 11))), reverse=True)
+        target = rng.randrange(1000, sum(values) + 5000)
+        cost_of_change = rng.randrange(0, 3000)
+        selected = coinselect.select_coins_bnb(values, target, cost_of_change)
+        expected = brute_force_excess(values, target, cost_of_change)
+        if expected is None:
+            assert selected is None
+        else:
+            assert len(set(selected)) == len(selected)
+            assert sum(values[i] for i in selected) - target == expected
+
+
+def test_select_coins_without_change_uses_bnb():
+    feerate = 5
+    input_fee = coinselect.fee_for(coinselect.INPUT_WEIGHTS["p2wpkh"], feerate)
+    base_fee = coinselect.fee_for(coinselect.transaction_weight([], [P2WSH_SCRIPT]), feerate)
+    # two coins whose effective values pay the payment and the base fee exactly
+    values = [600000 + input_fee, 400000 + input_fee + base_fee, 123456, 7777]
+    selection = coinselect.select_coins(coins_of(values), [(P2WSH_SCRIPT, 1000000)], feerate, P2WPKH_SCRIPT)
+    assert selection["algorithm"] == "bnb"
+    assert selection["change"] == 0
+    assert sorted(coin[2] for coin in selection["coins"]) == sorted(values[:2])
+    assert selection["fee"] == 2 * input_fee + base_fee
+
+
+def test_select_coins_falls_back_to_srd_with_change():
+    values = [5000000, 3000000, 2000000]
+    selection = coinselect.select_coins(coins_of(values), [(P2WSH_SCRIPT, 1000000)], 7, P2WPKH_SCRIPT,
+                                        rng=random.Random(1))
+    assert selection["algorithm"] == "srd"
+    assert selection["change"] >= coinselect.MIN_CHANGE
+    total = sum(coin[2] for coin in selection["coins"])
+    assert total == 1000000 + selection["change"] + selection["fee"]
+    weight = coinselect.transaction_weight(["p2wpkh"] * len(selection["coins"]), [P2WSH_SCRIPT, P2WPKH_SCRIPT])
+    assert selection["fee"] >= coinselect.fee_for(weight, 7)
+
+
+def test_select_coins_insufficient_funds():
+    assert coinselect.select_coins([], [(P2WSH_SCRIPT, 1000)], 1, P2WPKH_SCRIPT) is None
+    assert coinselect.select_coins(coins_of([600, 500]), [(P2WSH_SCRIPT, 1000)], 1, P2WPKH_SCRIPT) is None
+    # a coin worth less than the fee to spend it is never picked
+    dust_coin = coinselect.fee_for(coinselect.INPUT_WEIGHTS["p2wpkh"], 10)
+    assert coinselect.select_coins(coins_of([dust_coin] * 50), [(P2WSH_SCRIPT, 1)], 10, P2WPKH_SCRIPT) is None
+
+
+@pytest.mark.parametrize("leftover, change", [(coinselect.DUST - 1, 0), (coinselect.DUST, coinselect.DUST)])
+def test_select_coins_gives_change_below_dust_to_the_fee(leftover, change):
+    feerate = 2
+    input_fee = coinselect.fee_for(coinselect.INPUT_WEIGHTS["p2wpkh"], feerate)
+    change_fee = coinselect.fee_for(coinselect.output_weight(P2WPKH_SCRIPT), feerate)
+    base_fee = coinselect.fee_for(coinselect.transaction_weight([], [P2WSH_SCRIPT]), feerate)
+    amount = 100000
+    # one coin that leaves leftover after the change output, more than the cost of change,
+    # so branch-and-bound finds nothing and single random draw takes it
+    assert leftover > input_fee
+    value = amount + base_fee + input_fee + change_fee + leftover
+    selection = coinselect.select_coins(coins_of([value]), [(P2WSH_SCRIPT, amount)], feerate, P2WPKH_SCRIPT)
+    assert selection["algorithm"] == "srd"
+    assert selection["change"] == change
+    assert selection["fee"] == value - amount - change
+
+
+# Estimated weights are at or just above those of signed transactions, whose signatures are
+# 71 or 72 bytes, and the fee pays at least the fee rate on the real weight
+def test_fee_covers_the_signed_transaction():
+    rng = random.Random(36)
+    keys = [rng.randrange(1, 2**255).to_bytes(32, 'big') for _ in range(40)]
+    programs = [balance.get_p2wpkh_program(balance.get_pub_from_priv(priv)) for priv in keys]
+    for feerate in (1, 7, 33):
+        for count in (1, 2, 5, 40):
+            coins = coins_of([rng.randrange(20000, 200000) for _ in range(count)])
+            amount = sum(coin[2] for coin in coins) // 2
+            selection = coinselect.select_coins(coins, [(P2WSH_SCRIPT, amount)], feerate, programs[0],
+                                                rng=random.Random(count))
+            outputs = [spend.output_from_options(P2WSH_SCRIPT, amount)]
+            output_scripts = [P2WSH_SCRIPT]
+            if selection["change"]:
+                outputs.append(spend.output_from_options(programs[0], selection["change"]))
+                output_scripts.append(programs[0])
+            inputs = [{"txid": txid, "op_index": vout, "value_sats": value, "program": programs[key],
+                       "priv_key": keys[key]} for txid, vout, value, key in selection["coins"]]
+            _, tx_hex = spend.build_p2wpkh_transaction(inputs, outputs, workers=1)
+            # version, input count, inputs, output count, outputs and locktime count four times
+            stripped = 4 + 1 + 41 * len(inputs) + 1 + sum(map(len, outputs)) + 4
+            weight = 3 * stripped + len(tx_hex) // 2
+            estimate = coinselect.transaction_weight(["p2wpkh"] * len(inputs), output_scripts)
+            assert weight <= estimate <= weight + len(inputs)
+            assert selection["fee"] >= feerate * weight / 4
@@ -0,0 +1,95 @@
+from ecdsa import SECP256k1, VerifyingKey, util
+import hashlib
+import random
+
+import pytest
+
+import ecc
+
+# every backend that can run here, coincurve only when it is installed
+INSTALLED = [name for name in ecc.BACKENDS if name != "coincurve" or ecc.coincurve is not None]
+
+
+# Check a signature is strict DER as BIP66 requires and return (r, s)
+# https://github.com/bitcoin/bips/blob/master/bip-0066.mediawiki
+def parse_strict_der(signature: bytes):
+    assert 8 <= len(signature) <= 72
+    assert signature[0] == 0x30 and signature[1] == len(signature) - 2
+    values = []
+    offset = 2
+    for _ in range(2):
+        assert signature[offset] == 0x02
+        length = signature[offset + 1]
+        value = signature[offset + 2:offset + 2 + length]
+        assert len(value) == length and length > 0
+        # positive and minimally encoded
+        assert not value[0] & 0x80
+        assert not (length > 1 and value[0] == 0 and not value[1] & 0x80)
+        values.append(int.from_bytes(value, 'big'))
+        offset += 2 + length
+    assert offset == len(signature)
+    return tuple(values)
+
+
+def random_keys(count: int):
+    rng = random.Random(21)
+    return [(rng.randrange(1, ecc.N).to_bytes(32, 'big'), rng.getrandbits(256).to_bytes(32, 'big'))
+            for _ in range(count)]
+
+
+# The published secp256k1 RFC6979 vector: private key 1, SHA256("Satoshi Nakamoto")
+def test_rfc6979_satoshi_nakamoto_vector():
+    digest = hashlib.sha256(b"Satoshi Nakamoto").digest()
+    assert ecc.rfc6979_nonce(1, digest) == 0x8F8A276C19F4149656B280621E358CCE24F5F52542772691EE69063B74F15D15
+    expected = bytes.fromhex("3045022100934b1ea10a4b3c1757e2b0c017d0b6143ce3c9a7e6a4a49860d7a6ab210ee3d8"
+                             "02202442ce9d2b916064108014783e923ec36b49743e2ffa1c4496f01a512aafd9e5")
+    for name in INSTALLED:
+        assert ecc.load_backend(name).sign((1).to_bytes(32, 'big'), digest) == expected, name
+
+
+@pytest.mark.parametrize("k", [1, 2, 3, 255, 256, 2**255, 0xFF << 248, ecc.N - 1, ecc.N + 5])
+def test_generator_multiply_matches_ecdsa(k):
+    point = SECP256k1.generator * (k % ecc.N)
+    assert ecc.generator_multiply(k) == (point.x(), point.y())
+
+
+def test_generator_multiply_rejects_the_point_at_infinity():
+    with pytest.raises(ValueError):
+        ecc.generator_multiply(ecc.N)
+
+
+def test_backends_produce_the_same_keys_and_signatures():
+    python = ecc.load_backend("python")
+    for priv, digest in random_keys(64):
+        pubkey = python.pubkey(priv)
+        signature = python.sign(priv, digest)
+        for name in INSTALLED:
+            backend = ecc.load_backend(name)
+            assert backend.pubkey(priv) == pubkey, name
+            assert backend.sign(priv, digest) == signature, name
+
+
+def test_signatures_are_low_s_strict_der_and_valid():
+    high_s = 0
+    for priv, digest in random_keys(64):
+        signature = ecc.load_backend("python").sign(priv, digest)
+        r, s = parse_strict_der(signature)
+        assert 0 < r < ecc.N and 0 < s <= ecc.N // 2
+        z = int.from_bytes(digest, 'big') % ecc.N
+        k = ecc.rfc6979_nonce(int.from_bytes(priv, 'big'), digest)
+        # count the nonces that give a high s, so the low-S canonization is exercised
+        high_s += pow(k, -1, ecc.N) * (z + r * int.from_bytes(priv, 'big')) % ecc.N > ecc.N // 2
+        key = VerifyingKey.from_string(ecc.load_backend("python").pubkey(priv), curve=SECP256k1)
+        assert key.verify_digest(signature, digest, sigdecode=util.sigdecode_der)
+    assert high_s
+
+
+def test_der_encode_pads_high_bits_and_trims_leading_zeros():
+    assert ecc.der_encode(0x80, 1) == bytes.fromhex("300702020080020101")
+    assert parse_strict_der(ecc.der_encode(2**255, 0x7f)) == (2**255, 0x7f)
+    assert ecc.der_encode(1, 0x100) == bytes.fromhex("300702010102020100")
+
+
+def test_load_backend_rejects_unknown_names():
+    with pytest.raises(ValueError):
+        ecc.load_backend("openssl")
@@ -0,0 +1,135 @@
+from ecdsa import SECP256k1, VerifyingKey, util
+import hashlib
+import random
+
+import pytest
+
+import balance
+import spend
+
+
+def dsha256(data: bytes) -> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
+
+
+# Random p2wpkh coins as build_p2wpkh_transaction takes them
+def random_coins(count: int, seed: int = 22):
+    rng = random.Random(seed)
+    coins = []
+    for _ in range(count):
+        priv = rng.randrange(1, 2**255).to_bytes(32, 'big')
+        coins.append({
+            "txid": f"{rng.getrandbits(256):064x}",
+            "op_index": rng.randrange(4),
+            "value_sats": rng.randrange(1000, 10**8),
+            "program": balance.get_p2wpkh_program(balance.get_pub_from_priv(priv)),
+            "priv_key": priv,
+        })
+    return coins
+
+
+class Reader:
+    def __init__(self, data: bytes):
+        self.data = data
+        self.offset = 0
+
+    def read(self, n: int) -> bytes:
+        assert self.offset + n <= len(self.data)
+        self.offset += n
+        return self.data[self.offset - n:self.offset]
+
+    def compact_size(self) -> int:
+        first = self.read(1)[0]
+        size = {0xfd: 2, 0xfe: 4, 0xff: 8}.get(first)
+        return first if size is None else int.from_bytes(self.read(size), "little")
+
+
+# Parse a segwit transaction into (version, inputs, outputs, witnesses, locktime),
+# inputs as (outpoint, scriptSig, sequence) and outputs as serialized bytes
+def parse_transaction(raw: bytes):
+    reader = Reader(raw)
+    version = reader.read(4)
+    assert reader.read(2) == b"\x00\x01"
+    inputs = []
+    for _ in range(reader.compact_size()):
+        outpoint = reader.read(36)
+        inputs.append((outpoint, reader.read(reader.compact_size()), reader.read(4)))
+    outputs = []
+    for _ in range(reader.compact_size()):
+        start = reader.offset
+        reader.read(8)
+        reader.read(reader.compact_size())
+        outputs.append(raw[start:reader.offset])
+    witnesses = [[reader.read(reader.compact_size()) for _ in range(reader.compact_size())] for _ in inputs]
+    locktime = reader.read(4)
+    assert reader.offset == len(raw)
+    return version, inputs, outputs, witnesses, locktime
+
+
+# The BIP143 digest of one input, serialized in full without any cached midstate
+# https://github.com/bitcoin/bips/blob/master/bip-0143.mediawiki#specification
+def bip143_digest(version, inputs, outputs, locktime, position, script_code, value) -> bytes:
+    outpoint, _, sequence = inputs[position]
+    return dsha256(version
+                   + dsha256(b"".join(outpoint for outpoint, _, _ in inputs))
+                   + dsha256(b"".join(sequence for _, _, sequence in inputs))
+                   + outpoint
+                   + bytes([len(script_code)]) + script_code
+                   + value.to_bytes(8, "little")
+                   + sequence
+                   + dsha256(b"".join(outputs))
+                   + locktime
+                   + (1).to_bytes(4, "little"))
+
+
+@pytest.mark.parametrize("n, encoded", [
+    (0, "00"), (0xfc, "fc"), (0xfd, "fdfd00"), (0xffff, "fdffff"),
+    (0x10000, "fe00000100"), (0xffffffff, "feffffffff"), (2**32, "ff0000000001000000"),
+])
+def test_compact_size(n, encoded):
+    assert spend.compact_size(n).hex() == encoded
+
+
+def test_build_p2wpkh_transaction_signs_every_input_of_a_large_transaction():
+    coins = random_coins(300)
+    outputs = [spend.output_from_options(b"\x00\x20" + bytes(32), 5000),
+               spend.output_from_options(coins[0]["program"], 12345),
+               spend.output_from_options(b"\x6a" + bytes(80), 0)]
+    txid, tx_hex = spend.build_p2wpkh_transaction(coins, outputs, workers=1)
+    raw = bytes.fromhex(tx_hex)
+    # more than 252 inputs take the 0xfd count prefix
+    assert raw[6:9] == b"\xfd" + (300).to_bytes(2, "little")
+    version, inputs, parsed_outputs, witnesses, locktime = parse_transaction(raw)
+    assert parsed_outputs == outputs
+    midstate = spend.get_sighash_midstate([outpoint for outpoint, _, _ in inputs], outputs)
+    for position, (coin, (outpoint, script_sig, sequence), witness) in enumerate(zip(coins, inputs, witnesses)):
+        assert outpoint == bytes.fromhex(coin["txid"])[::-1] + coin["op_index"].to_bytes(4, "little")
+        assert script_sig == b"" and sequence == b"\xff\xff\xff\xff"
+        signature, pubkey = witness
+        assert balance.get_p2wpkh_program(pubkey) == coin["program"]
+        assert signature[-1] == 1
+        script_code = b"\x76\xa9\x14" + coin["program"][2:] + b"\x88\xac"
+        digest = bip143_digest(version, inputs, outputs, locktime, position, script_code, coin["value_sats"])
+        assert spend.get_input_commitment_hash(midstate, outpoint, spend.get_p2wpkh_scriptcode(coin["program"]),
+                                               coin["value_sats"]) == digest
+        key = VerifyingKey.from_string(pubkey, curve=SECP256k1)
+        assert key.verify_digest(signature[:-1], digest, sigdecode=util.sigdecode_der)
+    stripped = version + b"\xfd" + (300).to_bytes(2, "little")
+    stripped += b"".join(outpoint + b"\x00" + sequence for outpoint, _, sequence in inputs)
+    stripped += bytes([len(outputs)]) + b"".join(outputs) + locktime
+    assert txid == dsha256(stripped)[::-1].hex()
+
+
+def test_get_commitment_hash_matches_the_full_digest_for_one_input():
+    coin = random_coins(1, seed=7)[0]
+    outpoint, serialized_input = spend.input_from_utxo(bytes.fromhex(coin["txid"]), coin["op_index"])
+    outputs = [spend.output_from_options(coin["program"], 1000)]
+    script_code = spend.get_p2wpkh_scriptcode(coin["program"])
+    inputs = [(outpoint, b"", b"\xff\xff\xff\xff")]
+    expected = bip143_digest((2).to_bytes(4, "little"), inputs, outputs, bytes(4), 0, script_code[1:], coin["value_sats"])
+    assert spend.get_commitment_hash(outpoint, script_code, coin["value_sats"], outputs) == expected
+
+
+def test_sign_inputs_in_workers_gives_the_same_witnesses():
+    jobs = [(coin["priv_key"], dsha256(coin["txid"].encode())) for coin in random_coins(spend.PARALLEL_SIGN_MIN_INPUTS)]
+    assert spend.sign_inputs(jobs, workers=2) == spend.sign_inputs(jobs, workers=1)